@@ -0,0 +1,120 @@
+"""
+This is a NumPy simulator that plays many random games at the same time.
+It is used by the UCT search to get several playouts per leaf for the
+price of a handful of array operations, instead of one Python loop per game.
+
+All the games start from the same state, so after every ply it is the
+same player's turn in every game that is still running. The boards are
+stored as two boolean arrays of shape (number of games, rows, cols): one
+for the player to move at the start and one for the other player.
+The boards can have any size and connect length (see games/board.py).
+
+Every ply costs a few array operations whatever the number of games, so
+the simulator only beats playing the games one by one in Python (see
+_random_rollout in ai/uct.py) from about 32 games at once; with fewer,
+num_playouts > 1 makes the search slower.
+"""
+import random
+
+import numpy as np
+# (row step, column step) of the four kinds of lines.
+_DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+def play_out(game_state, num_playouts, rng=None):
+    """
+    Plays num_playouts random games from game_state until they are over.
+    Returns a dictionary mapping every outcome ('x', 'o', or ' ' for a draw)
+    to the number of games that ended that way.
+    rng is a random.Random (or the random module itself, by default): the
+    NumPy generator the games are played with is seeded from it, so a
+    seeded search also gets the same batch playouts every time.
+    """
+    if rng is None:
+        rng = random
+    rng = np.random.default_rng(rng.getrandbits(64))
+
+    mover = game_state.current_player_symbol()
+    symbols = (mover, 'o' if mover == 'x' else 'x')
+    geometry = game_state._board.geometry
+    planes, heights = _encode(game_state._board, symbols, num_playouts)
+    outcomes = {'x': 0, 'o': 0, ' ': 0}
+
+    playing = np.arange(num_playouts)
+    num_moves = game_state._board._num_moves
+    turn = 0
+    while playing.size:
+        legal = heights[playing] < geometry.rows
+        scores = rng.random(legal.shape)
+        scores[~legal] = -1.0
+        cols = scores.argmax(axis=1)
+        rows = heights[playing, cols]
+        planes[turn, playing, rows, cols] = True
+        heights[playing, cols] += 1
+        num_moves += 1
+
+        # Only the games still running are looked at: the finished ones
+        # keep their boards but are never played on again.
+        won = _four_in_a_row(planes[turn][playing], geometry.connect)
+        outcomes[symbols[turn]] += int(won.sum())
+        playing = playing[~won]
+        if num_moves == geometry.rows * geometry.cols:
+            # Every running game has the same number of moves, so they
+            # all fill up on the same ply.
+            outcomes[' '] += playing.size
+            break
+        turn = 1 - turn
+
+    return outcomes
+
+
+def _encode(board, symbols, num_playouts):
+    """
+    Copies the board into the arrays the simulator plays on.
+    """
+    geometry = board.geometry
+    plane = np.zeros((2, geometry.rows, geometry.cols), dtype=bool)
+    for row_index in range(geometry.rows):
+        for col_index in range(geometry.cols):
+            spot = board._symbol_at(row_index, col_index)
+            if spot != ' ':
+                plane[symbols.index(spot), row_index, col_index] = True
+    planes = np.repeat(plane[:, np.newaxis], num_playouts, axis=1)
+    heights = np.tile(np.array(board._heights, dtype=np.intp), (num_playouts, 1))
+    return planes, heights
+
+
+def _four_in_a_row(planes, connect=4):
+    """
+    Returns, for every board in planes, True if it holds connect in a row.
+    For every direction, the board is AND-ed with itself shifted by one,
+    two, ... connect - 1 cells, which leaves True only where a line starts.
+    """
+    rows, cols = planes.shape[1:]
+    reach = connect - 1
+    won = np.zeros(planes.shape[0], dtype=bool)
+    for dr, dc in _DIRECTIONS:
+        if reach * dr >= rows or reach * abs(dc) >= cols:
+            # No line of that direction fits on the board.
+            continue
+        line = _shifted(planes, 0, dr, dc, reach)
+        for k in range(1, connect):
+            line = line & _shifted(planes, k, dr, dc, reach)
+        won |= line.any(axis=(1, 2))
+    return won
+
+
+def _shifted(planes, k, dr, dc, reach):
+    """
+    Returns the view of planes that is k steps along (dr, dc) from the
+    cells where a line of reach + 1 cells could start.
+    """
+    rows, cols = planes.shape[1:]
+    row_start = k * dr
+    row_stop = rows - reach * dr + k * dr
+    if dc >= 0:
+        col_start = k * dc
+        col_stop = cols - reach * dc + k * dc
+    else:
+        col_start = reach - k
+        col_stop = cols - k
+    return planes[:, row_start:row_stop, col_start:col_stop]
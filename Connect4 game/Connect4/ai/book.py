@@ -0,0 +1,228 @@
+"""
+This is the opening book: a table of the move to play in the positions of
+the first plies of a game, worked out in advance by long searches.
+At the start of a game the tree is at its widest, so a search of a few
+seconds learns little there, while the book answers at once.
+
+The positions are keyed by Board.position_code(), so a position and its
+mirror image share one entry, and the moves are stored for the position
+whose code it is (mirrored back by move_for()).
+
+The book file is a hashed table with open addressing:
+
+    header  b"C4OB", a version byte, 3 unused bytes, the number of slots
+            and the number of entries, as unsigned 64 bit integers.
+    keys    one unsigned 64 bit code per slot, 0 for an empty slot.
+    moves   one byte per slot.
+
+The file is mapped in memory rather than read, so loading the book costs
+nothing and only the pages that are looked at are read from the disk.
+
+To build the book, run from the folder of main.py:
+python3 -m ai.book --plies 6 --iterations 20000 --output ai/book.bin
+The game uses ai/book.bin when it exists (see new_search in ai/uct.py).
+"""
+
+import argparse
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from ai.budget import Budget
+from games.metadata import MetaData
+
+MAGIC = b"C4OB"
+VERSION = 1
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")
+
+_HEADER = struct.Struct("<4sBxxxQQ")
+_MULTIPLIER = 0x9E3779B97F4A7C15
+_MASK = (1 << 64) - 1
+
+_book = None
+_book_loaded = False
+
+
+class OpeningBook:
+    """
+    The book stored in the file at path.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_slots, self.num_entries = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not an opening book of version %d" % VERSION)
+        view = memoryview(self._map)
+        keys_end = _HEADER.size + 8 * self.num_slots
+        self._keys = view[_HEADER.size:keys_end].cast('Q')
+        self._moves = view[keys_end:keys_end + self.num_slots].cast('b')
+
+    def __len__(self):
+        return self.num_entries
+
+    def get(self, code):
+        """
+        Returns the move stored for code, or None if there is none.
+        """
+        slot = _slot(code, self.num_slots)
+        while True:
+            key = self._keys[slot]
+            if key == code:
+                return self._moves[slot]
+            if key == 0:
+                return None
+            slot = (slot + 1) % self.num_slots
+
+    def move_for(self, state):
+        """
+        Returns the book move of the player to move in state, or None if
+        the position is not in the book.
+        """
+        code, mirrored = state._board.position_code(state.current_player_symbol())
+        move = self.get(code)
+        if move is None:
+            return None
+        if mirrored:
+            move = state.mirror_move(move)
+        if not state._board.valid_move(move):
+            return None
+        return move
+
+    def close(self):
+        self._keys.release()
+        self._moves.release()
+        self._map.close()
+        self._file.close()
+
+
+def lookup(state):
+    """
+    Returns the move of the book in ai/book.bin for state, or None if the
+    position is not in it or there is no book. The book is opened the
+    first time it is needed. The book is only for the 6 x 7 board.
+    """
+    global _book
+    global _book_loaded
+
+    if not state._board.geometry.is_default():
+        return None
+    if not _book_loaded:
+        _book_loaded = True
+        if os.path.exists(BOOK_PATH):
+            _book = OpeningBook(BOOK_PATH)
+    if _book is None:
+        return None
+    return _book.move_for(state)
+
+
+def write_book(path, entries):
+    """
+    Writes the book made of entries, a dictionary from position codes to
+    moves, to the file at path. The table is kept at most half full, so
+    that a lookup finds its key or an empty slot after a few probes.
+    """
+    num_slots = max(2 * len(entries), 1)
+    keys = [0] * num_slots
+    moves = bytearray(num_slots)
+    for code, move in entries.items():
+        slot = _slot(code, num_slots)
+        while keys[slot] != 0:
+            slot = (slot + 1) % num_slots
+        keys[slot] = code
+        moves[slot] = move
+
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, num_slots, len(entries)))
+        f.write(struct.pack("<%dQ" % num_slots, *keys))
+        f.write(moves)
+
+
+def build(plies, budget, num_workers=None, seed=0):
+    """
+    Searches every position of the first plies plies of the game (up to
+    mirror images, and leaving out the finished ones) with budget, on
+    num_workers processes. Returns the entries of the book.
+    """
+    positions = _positions(plies)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        jobs = [executor.submit(_search_position, moves, budget, seed + i)
+                for i, moves in enumerate(positions.values())]
+        return dict(job.result() for job in jobs)
+
+
+def _positions(plies):
+    """
+    Returns one sequence of moves leading to every position with fewer
+    than plies moves, keyed by the code of the position.
+    """
+    positions = {}
+    layer = [[]]
+    for _ in range(plies):
+        next_layer = []
+        for moves in layer:
+            state = _state_after(moves)
+            if state.game_over():
+                continue
+            code, _ = state._board.position_code(state.current_player_symbol())
+            if code in positions:
+                continue
+            positions[code] = moves
+            for move in state.possible_moves():
+                next_layer.append(moves + [move])
+        layer = next_layer
+    return positions
+
+
+def _search_position(moves, budget, seed):
+    """
+    Runs in a worker process. Returns the code of the position reached by
+    moves and the move the search chose there, mirrored like the code.
+    """
+    import ai.uct as uct
+    from games.gamestate import _evaluation_function
+
+    state = _state_after(moves)
+    move = uct.Search(_evaluation_function, budget=budget, seed=seed).get_best_move(state)
+    code, mirrored = state._board.position_code(state.current_player_symbol())
+    if mirrored:
+        move = state.mirror_move(move)
+    return code, move
+
+
+def _state_after(moves):
+    """
+    Returns the state after moves, with the AI to move.
+    """
+    from games.gamestate import GameState
+
+    metadata = MetaData()
+    metadata.player_symbol = 'o'
+    metadata.ai_symbol = 'x'
+    metadata.player_goes_first = len(moves) % 2 == 1
+    state = GameState(metadata, None)
+    for move in moves:
+        state.take_turn(move)
+    return state
+
+
+def _slot(code, num_slots):
+    return ((code * _MULTIPLIER) & _MASK) % num_slots
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the opening book.")
+    parser.add_argument("--plies", type=int, default=6,
+                        help="the book holds the positions with fewer moves than this")
+    parser.add_argument("--iterations", type=int, default=20000,
+                        help="iterations of the search of every position")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=BOOK_PATH)
+    args = parser.parse_args()
+
+    entries = build(args.plies, Budget(iterations=args.iterations), args.workers, args.seed)
+    write_book(args.output, entries)
+    print("%d positions written to %s" % (len(entries), args.output))
@@ -0,0 +1,126 @@
+"""
+This is how we tell the UCT search when to stop.
+A Budget can limit the number of iterations, the wall-clock time, the
+processor time and the size of the tree, in any combination: the search
+stops as soon as one of the limits is reached.
+
+Reading a clock costs more than a search iteration's bookkeeping, so the
+clocks are only read every check_every iterations. They are first read
+after one iteration, so that a search started when its time is already
+up, for example after the exact solver gave up, still has a move to play.
+"""
+import copy
+from time import monotonic, process_time
+
+from ai.tree import BYTES_PER_NODE
+
+
+class Budget:
+    """
+    iterations:  number of search iterations.
+    seconds:     wall-clock time, counted from the start of the search.
+    deadline:    a time.monotonic() value the search must stop at.
+    cpu_seconds: processor time used by the searching process.
+    max_nodes:   number of nodes in the tree.
+    max_memory:  bytes used by the nodes of the tree.
+    extensions:  how many more times the search may run when the best
+                 child of the root is not also the most visited one.
+                 Every extension counts its iterations, processor time
+                 and nodes anew, so a search may take up to
+                 1 + extensions times them; the wall-clock time stays
+                 that of the move (see Budget.fixed). There are none by
+                 default.
+    """
+
+    def __init__(self, iterations=None, seconds=None, deadline=None,
+                 cpu_seconds=None, max_nodes=None, max_memory=None,
+                 extensions=0, check_every=32):
+        self.iterations = iterations
+        self.seconds = seconds
+        self.deadline = deadline
+        self.cpu_seconds = cpu_seconds
+        self.max_nodes = max_nodes
+        if max_memory is not None:
+            memory_nodes = max_memory // BYTES_PER_NODE
+            if max_nodes is None or memory_nodes < max_nodes:
+                self.max_nodes = memory_nodes
+        self.extensions = extensions
+        self.check_every = check_every
+
+    def __str__(self):
+        limits = ["%s=%s" % (k, v) for k, v in self.__dict__.items() if v is not None]
+        return "Budget(" + ", ".join(limits) + ")"
+
+    def start(self):
+        """
+        Returns a BudgetRun counting from now.
+        """
+        return BudgetRun(self)
+
+    def split(self, num_workers):
+        """
+        Returns the budget of one of num_workers processes sharing this
+        one: the iterations are divided between them, and they all stop
+        at the same wall-clock deadline.
+        """
+        result = self.fixed()
+        if self.iterations is not None:
+            result.iterations = -(-self.iterations // num_workers)
+        return result
+
+    def fixed(self):
+        """
+        Returns a copy of this budget whose wall-clock time is counted from
+        now, whenever it is started: seconds become a deadline.
+        """
+        result = copy.copy(self)
+        result.deadline = self._deadline()
+        result.seconds = None
+        return result
+
+    def _deadline(self):
+        deadline = self.deadline
+        if self.seconds is not None:
+            from_now = monotonic() + self.seconds
+            if deadline is None or from_now < deadline:
+                deadline = from_now
+        return deadline
+
+
+DEFAULT_BUDGET = Budget(cpu_seconds=2)
+
+
+class BudgetRun:
+    """
+    One search running on a Budget.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.iterations = 0
+        self._deadline = budget._deadline()
+        if budget.cpu_seconds is not None:
+            self._cpu_deadline = process_time() + budget.cpu_seconds
+        else:
+            self._cpu_deadline = None
+        self._next_check = 1
+
+    def within(self, tree):
+        """
+        Returns True if the search may run one more iteration on tree.
+        Must be called once per iteration.
+        """
+        budget = self.budget
+        if budget.iterations is not None and self.iterations >= budget.iterations:
+            return False
+        if budget.max_nodes is not None \
+                and (len(tree) >= budget.max_nodes or tree.is_full()):
+            return False
+        if self.iterations >= self._next_check:
+            self._next_check = self.iterations + budget.check_every
+            if self._deadline is not None and monotonic() >= self._deadline:
+                return False
+            if self._cpu_deadline is not None and process_time() >= self._cpu_deadline:
+                return False
+        self.iterations += 1
+        return True
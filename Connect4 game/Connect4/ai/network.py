@@ -0,0 +1,380 @@
+"""
+This is a small value and policy network, written with NumPy only and
+run on the CPU, that the UCT search can use instead of random playouts
+(see the network option of ai/uct.py).
+
+The input is the board seen by the player to move: one plane of their
+stones and one of the opponent's, rows x cols each, flattened. It goes
+through a few fully connected layers with ReLU, and then into two heads:
+
+    value   the probabilities that the player to move wins, that the
+            game is a draw and that they lose (a softmax over 3).
+    policy  a prior on every column, a softmax over the columns that are
+            not full.
+
+The search evaluates its leaves in batches, so one matrix product per
+layer evaluates a whole batch of leaves.
+
+The network is trained on the games of gameplay/selfplay.py saved with
+--records (see games/record.py): every position of a game is an example,
+with the result of the game as the value to learn and the visits of the
+root children as the policy to learn. Its mirror image is a second
+example. train_loop() alternates self-play with the current network and
+training on the games played.
+
+The weight file is:
+
+    header  b"C4NN", a version byte, rows, cols and connect bytes, the
+            number of hidden layers, and the size of every hidden layer
+            as unsigned 16 bit integers.
+    weights the weights and biases of the hidden layers, then of the
+            value head and of the policy head, as little endian 16 bit
+            floats, each matrix stored row by row.
+
+To train a network from scratch, run from the folder of main.py:
+python3 -m ai.network --rounds 10 --games 100 --iterations 400 --output ai/network.bin
+or, to train on games already played:
+python3 -m ai.network --records games.c4gr --epochs 20 --output ai/network.bin
+The game uses ai/network.bin when it exists (see new_search in ai/uct.py).
+"""
+
+import argparse
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    # Without NumPy there is no network: default_network() finds none,
+    # and the game plays out its leaves instead.
+    np = None
+
+from games.board import get_geometry, _INDEX
+
+MAGIC = b"C4NN"
+VERSION = 1
+NETWORK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "network.bin")
+
+_HEADER = struct.Struct("<4sBBBBB")
+
+# Columns of the value head.
+WIN = 0
+DRAW = 1
+LOSS = 2
+
+_network = None
+_network_loaded = False
+
+
+class Network:
+    """
+    A network for the boards of rows rows, cols columns and connect in a
+    row, with hidden layers of the given sizes. The weights are drawn at
+    random from seed.
+    """
+
+    def __init__(self, rows=6, cols=7, connect=4, hidden=(128, 64), seed=0):
+        self.geometry = get_geometry(rows, cols, connect)
+        self.hidden = tuple(hidden)
+        rng = np.random.default_rng(seed)
+        sizes = (2 * rows * cols,) + self.hidden
+        self.layers = []
+        for n_in, n_out in zip(sizes[:-1], sizes[1:]):
+            self.layers.append(_layer(rng, n_in, n_out))
+        self.value_head = _layer(rng, sizes[-1], 3)
+        self.policy_head = _layer(rng, sizes[-1], cols)
+
+        # The bit of every cell of the board, row by row, in the bytes
+        # of a bitboard (see games/board.py).
+        h1 = self.geometry.h1
+        self._cells = np.array([col * h1 + row for row in range(rows) for col in range(cols)])
+        self._num_bytes = (cols * h1 + 7) // 8
+
+    def parameters(self):
+        """
+        Returns the arrays of the weights, in the order of the weight file.
+        """
+        result = []
+        for weights, bias in self.layers + [self.value_head, self.policy_head]:
+            result.append(weights)
+            result.append(bias)
+        return result
+
+    def encode(self, state):
+        """
+        Returns the input of the network for state, and which of its
+        columns are not full.
+        """
+        assert(state._board.geometry is self.geometry)
+        board = state._board
+        index = _INDEX[state.current_player_symbol()]
+        mine = self._plane(board._bitboards[index])
+        theirs = self._plane(board._bitboards[1 - index])
+        legal = np.array(board._heights) < self.geometry.rows
+        return np.concatenate((mine, theirs)), legal
+
+    def evaluate(self, inputs, legal):
+        """
+        Evaluates a batch of positions: inputs holds one input per row
+        and legal one row of free columns per position, as given by
+        encode(). Returns the value probabilities (one row of WIN, DRAW
+        and LOSS per position) and the priors of the columns.
+        """
+        hidden = inputs
+        for weights, bias in self.layers:
+            hidden = np.maximum(hidden @ weights + bias, 0.0)
+        values = _softmax(hidden @ self.value_head[0] + self.value_head[1])
+        logits = hidden @ self.policy_head[0] + self.policy_head[1]
+        logits = np.where(legal, logits, -np.inf)
+        return values, _softmax(logits)
+
+    def _plane(self, bitboard):
+        bits = np.unpackbits(np.frombuffer(bitboard.to_bytes(self._num_bytes, "little"),
+                                           dtype=np.uint8), bitorder="little")
+        return bits[self._cells].astype(np.float32)
+
+
+def _layer(rng, n_in, n_out):
+    # He initialisation, for the ReLUs.
+    weights = rng.standard_normal((n_in, n_out)).astype(np.float32) * np.sqrt(2.0 / n_in)
+    return weights, np.zeros(n_out, dtype=np.float32)
+
+
+def _softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def save(network, path):
+    """
+    Writes the weights of network to the file at path.
+    """
+    geometry = network.geometry
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, geometry.rows, geometry.cols, geometry.connect,
+                             len(network.hidden)))
+        f.write(struct.pack("<%dH" % len(network.hidden), *network.hidden))
+        for array in network.parameters():
+            f.write(array.astype("<f2").tobytes())
+
+
+def load(path):
+    """
+    Returns the network stored in the file at path.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, rows, cols, connect, num_hidden = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a network of version %d" % VERSION)
+    offset = _HEADER.size
+    hidden = struct.unpack_from("<%dH" % num_hidden, data, offset)
+    offset += 2 * num_hidden
+
+    network = Network(rows, cols, connect, hidden)
+    for array in network.parameters():
+        size = array.size
+        values = np.frombuffer(data, dtype="<f2", count=size, offset=offset)
+        array[...] = values.reshape(array.shape)
+        offset += 2 * size
+    return network
+
+
+def default_network(geometry):
+    """
+    Returns the network in ai/network.bin, or None if there is none, it
+    is not for the boards of geometry or NumPy is not installed. It is
+    loaded the first time it is needed.
+    """
+    global _network
+    global _network_loaded
+
+    if np is None:
+        return None
+    if not _network_loaded:
+        _network_loaded = True
+        if os.path.exists(NETWORK_PATH):
+            _network = load(NETWORK_PATH)
+    if _network is None or _network.geometry is not geometry:
+        return None
+    return _network
+
+
+def examples(records, network):
+    """
+    Returns the inputs, free columns, values and policies to learn from
+    the games of records (games.record.GameRecord), with their mirror
+    images. The policy of a position is the share of the visits of every
+    column at the root of the search that played it, or the move played
+    if the visits were not kept (or are those of another position: the
+    self-play of older versions kept the visits of the last search when
+    the solver found the move). Unfinished games are left out.
+    """
+    cols = network.geometry.cols
+    inputs = []
+    legal = []
+    values = []
+    policies = []
+    for record in records:
+        if record.winner is None:
+            continue
+        state = record.replay(num_moves=0)
+        for i, move in enumerate(record.moves):
+            symbol = state.current_player_symbol()
+            if record.winner == ' ':
+                value = DRAW
+            elif record.winner == symbol:
+                value = WIN
+            else:
+                value = LOSS
+            planes, free = network.encode(state)
+            policy = np.zeros(cols, dtype=np.float32)
+            if record.visits is not None:
+                policy[:] = record.visits[i]
+            if policy[move] == 0 or policy[~free].any():
+                policy[:] = 0.0
+                policy[move] = 1.0
+            policy /= policy.sum()
+            mirrored = planes.reshape(2, -1, cols)[:, :, ::-1].reshape(-1)
+            inputs += [planes, mirrored]
+            legal += [free, free[::-1]]
+            values += [value, value]
+            policies += [policy, policy[::-1]]
+            state.take_turn(move)
+    return (np.array(inputs, dtype=np.float32), np.array(legal), np.array(values),
+            np.array(policies, dtype=np.float32))
+
+
+def train(network, data, epochs=10, batch_size=256, learning_rate=0.001, seed=0):
+    """
+    Trains network on data, as returned by examples(), with Adam: the
+    loss is the cross entropy of the value plus that of the policy.
+    Returns the mean loss of the last epoch.
+    """
+    inputs, legal, values, policies = data
+    parameters = network.parameters()
+    moments = [np.zeros_like(p) for p in parameters]
+    squares = [np.zeros_like(p) for p in parameters]
+    rng = np.random.default_rng(seed)
+    step = 0
+    loss = 0.0
+    for _ in range(epochs):
+        order = rng.permutation(len(inputs))
+        total_loss = 0.0
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            batch_loss, gradients = _gradients(network, inputs[batch], legal[batch],
+                                               values[batch], policies[batch])
+            total_loss += batch_loss * len(batch)
+            step += 1
+            for p, g, m, v in zip(parameters, gradients, moments, squares):
+                m *= 0.9
+                m += 0.1 * g
+                v *= 0.999
+                v += 0.001 * g * g
+                m_hat = m / (1 - 0.9 ** step)
+                v_hat = v / (1 - 0.999 ** step)
+                p -= learning_rate * m_hat / (np.sqrt(v_hat) + 1e-8)
+        loss = total_loss / max(len(order), 1)
+    return loss
+
+
+def _gradients(network, inputs, legal, values, policies):
+    """
+    Returns the mean loss of the batch and the gradients of the
+    parameters, in the order of Network.parameters().
+    """
+    n = len(inputs)
+    activations = [inputs]
+    for weights, bias in network.layers:
+        activations.append(np.maximum(activations[-1] @ weights + bias, 0.0))
+    top = activations[-1]
+
+    value_probs = _softmax(top @ network.value_head[0] + network.value_head[1])
+    logits = top @ network.policy_head[0] + network.policy_head[1]
+    policy_probs = _softmax(np.where(legal, logits, -np.inf))
+
+    loss = -np.log(value_probs[np.arange(n), values] + 1e-9).mean() \
+        - (policies * np.log(policy_probs + 1e-9)).sum(axis=1).mean()
+
+    # Softmax and cross entropy together have the gradient probs - target.
+    d_value = value_probs
+    d_value[np.arange(n), values] -= 1.0
+    d_value /= n
+    d_policy = (policy_probs - policies) / n
+
+    head_gradients = [top.T @ d_value, d_value.sum(axis=0),
+                      top.T @ d_policy, d_policy.sum(axis=0)]
+    d_top = d_value @ network.value_head[0].T + d_policy @ network.policy_head[0].T
+
+    layer_gradients = []
+    for i in range(len(network.layers) - 1, -1, -1):
+        weights, _ = network.layers[i]
+        d_top = d_top * (activations[i + 1] > 0)
+        layer_gradients = [activations[i].T @ d_top, d_top.sum(axis=0)] + layer_gradients
+        d_top = d_top @ weights.T
+    return loss, layer_gradients + head_gradients
+
+
+def train_loop(path, rounds, num_games, iterations, epochs, num_workers=None, seed=0,
+               hidden=(128, 64)):
+    """
+    Plays num_games games of self-play with the network in the file at
+    path (a new one if there is none), searching iterations iterations
+    per move, then trains the network on all the games played so far and
+    writes it back; rounds times. The games are kept in path + ".c4gr".
+    """
+    import io
+    from gameplay import selfplay
+    from games.record import RecordWriter, read_records
+
+    if os.path.exists(path):
+        network = load(path)
+    else:
+        network = Network(hidden=hidden, seed=seed)
+        save(network, path)
+    records_path = path + ".c4gr"
+    engine = "iterations=%d,network=%s" % (iterations, path)
+    for round_number in range(rounds):
+        with RecordWriter(records_path) as records:
+            score = selfplay.run(num_games, engine, engine, io.StringIO(), num_workers,
+                                 seed + round_number * num_games, records)
+        data = examples(read_records(records_path), network)
+        loss = train(network, data, epochs, seed=seed + round_number)
+        save(network, path)
+        print("round %d: %d positions, loss %.3f, draws %d"
+              % (round_number, len(data[0]), loss, score["draw"]))
+    return network
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trains the value and policy network.")
+    parser.add_argument("--records", help="train on the games of this record file only")
+    parser.add_argument("--rounds", type=int, default=10,
+                        help="rounds of self-play and training")
+    parser.add_argument("--games", type=int, default=100, help="games of every round")
+    parser.add_argument("--iterations", type=int, default=400,
+                        help="iterations of the search of every move of the self-play")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--hidden", default="128,64",
+                        help="comma separated sizes of the hidden layers")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=NETWORK_PATH)
+    args = parser.parse_args()
+    if np is None:
+        parser.error("the network needs NumPy")
+
+    hidden = tuple(int(n) for n in args.hidden.split(","))
+    if args.records:
+        from games.record import read_records
+
+        network = load(args.output) if os.path.exists(args.output) \
+            else Network(hidden=hidden, seed=args.seed)
+        loss = train(network, examples(read_records(args.records), network), args.epochs,
+                     seed=args.seed)
+        save(network, args.output)
+        print("loss %.3f, written to %s" % (loss, args.output))
+    else:
+        train_loop(args.output, args.rounds, args.games, args.iterations, args.epochs,
+                   args.workers, args.seed, hidden)
@@ -0,0 +1,240 @@
+"""
+This is an exact solver for the end of the game. Once few cells are left
+empty, it is cheaper to look at every possible game than to sample them
+with random playouts, and the answer is exact.
+
+It is a negamax search with alpha-beta pruning, played on the bitboards
+of games/board.py:
+
+    current  the cells of the player to move,
+    mask     the filled cells.
+
+Playing a move is a couple of integer operations, and so is finding the
+cells where a player would make a line (four in a row on the usual
+board, any connect length on the others: see Geometry.winning_cells in
+games/board.py). The search never plays a
+move that lets the opponent win at once, and looks at the columns from
+the center out, where the best moves usually are.
+
+The score of a position is 0 for a draw, and otherwise positive if the
+player to move wins and negative if they lose, the larger the sooner:
+a win with the last stone of the board scores 1.
+
+A Solver works on the boards of one Geometry, whose masks it keeps.
+
+Every position searched keeps an upper bound on its score in a
+transposition table of fixed size. The scores are found by a series of
+searches with a window of width one, each narrowing the range the score
+can be in, so that most searches are cut off early and the later ones
+find the earlier results in the table.
+
+A call can be given a deadline, so that the solver fits in the time of a
+move. The clock is only read every _CHECK_EVERY nodes.
+"""
+from array import array
+from time import monotonic
+
+from games.board import get_geometry
+
+_CHECK_EVERY = 1024
+
+
+class OutOfNodes(Exception):
+    """
+    Raised when a Solver has searched more nodes than it may, or has
+    gone past its deadline.
+    """
+    pass
+
+
+class Solver:
+    """
+    A solver for the boards of geometry (the 6 x 7 board by default) and
+    its transposition table of table_size entries, which is kept from one
+    call to the next. With max_nodes, a call that needs to search more
+    nodes than that raises OutOfNodes, and so does a call still searching
+    at its deadline.
+    """
+
+    def __init__(self, geometry=None, table_size=1 << 20, max_nodes=None):
+        if geometry is None:
+            geometry = get_geometry()
+        self.geometry = geometry
+        self.table_size = table_size
+        self.max_nodes = max_nodes
+        self.num_nodes = 0
+        self._deadline = None
+        self._next_check = 0
+
+        rows = geometry.rows
+        cols = geometry.cols
+        self._cells = rows * cols
+        self._bottom = geometry.bottom
+        self._full = geometry.full
+        self._columns = [((1 << rows) - 1) << (col * geometry.h1) for col in range(cols)]
+        self._order = sorted(range(cols), key=lambda col: abs(col - (cols - 1) / 2))
+        self._min_score = -(self._cells // 2) + 3
+        self._winning_cells = geometry.winning_cells
+
+        if cols * geometry.h1 <= 64:
+            self._keys = array('Q', bytes(8 * table_size))
+        else:
+            # The keys of larger boards do not fit in 64 bits.
+            self._keys = [0] * table_size
+        self._values = array('h', bytes(2 * table_size))
+
+    def best_move(self, game_state, deadline=None):
+        """
+        Returns (move, score) for the player to move in game_state, which
+        must not be over: the move with the best score, and that score.
+        deadline, if given, is the time.monotonic() value to give up at.
+        """
+        board = game_state._board
+        current = board._bitboards[0 if game_state.current_player_symbol() == 'x' else 1]
+        mask = board._bitboards[0] | board._bitboards[1]
+        num_moves = board._num_moves
+        self.num_nodes = 0
+        self._deadline = deadline
+        self._next_check = self._limit(0)
+
+        playable = self._playable(mask)
+        wins = self._winning_cells(current, mask) & playable
+        for col in self._order:
+            if wins & self._columns[col]:
+                return col, (self._cells + 1 - num_moves) // 2
+
+        best_move = None
+        best_score = None
+        for col in self._order:
+            move = playable & self._columns[col]
+            if move:
+                score = -self.solve(current ^ mask, mask | move, num_moves + 1)
+                if best_score is None or score > best_score:
+                    best_move = col
+                    best_score = score
+        return best_move, best_score
+
+    def solve(self, current, mask, num_moves):
+        """
+        Returns the score of the position for the player whose cells are
+        current, num_moves stones having been played.
+        """
+        cells = self._cells
+        if self._winning_cells(current, mask) & self._playable(mask):
+            return (cells + 1 - num_moves) // 2
+        low = -((cells - num_moves) // 2)
+        high = (cells + 1 - num_moves) // 2
+        while low < high:
+            middle = low + (high - low) // 2
+            # Try the windows near 0 first, where most games end.
+            if middle <= 0 and _half(low) < middle:
+                middle = _half(low)
+            elif middle >= 0 and _half(high) > middle:
+                middle = _half(high)
+            score = self._negamax(current, mask, num_moves, middle, middle + 1)
+            if score <= middle:
+                high = score
+            else:
+                low = score
+        return low
+
+    def _negamax(self, current, mask, num_moves, alpha, beta):
+        """
+        Returns the score of the position if it is between alpha and beta,
+        and otherwise a bound on it on the side of the window it is out of.
+        The player to move must not be able to win at once.
+        """
+        self.num_nodes += 1
+        if self.num_nodes > self._next_check:
+            self._check_limits()
+
+        cells = self._cells
+        moves = self._non_losing_moves(current, mask)
+        if moves == 0:
+            return -((cells - num_moves) // 2)
+        if num_moves >= cells - 2:
+            return 0
+
+        low = -((cells - 2 - num_moves) // 2)
+        if alpha < low:
+            alpha = low
+            if alpha >= beta:
+                return alpha
+
+        high = (cells - 1 - num_moves) // 2
+        key = current + mask + self._bottom
+        slot = key % self.table_size
+        if self._keys[slot] == key:
+            high = self._values[slot] + self._min_score - 1
+        if beta > high:
+            beta = high
+            if alpha >= beta:
+                return beta
+
+        opponent = current ^ mask
+        columns = self._columns
+        for col in self._order:
+            move = moves & columns[col]
+            if move:
+                score = -self._negamax(opponent, mask | move, num_moves + 1, -beta, -alpha)
+                if score >= beta:
+                    return score
+                if score > alpha:
+                    alpha = score
+
+        self._keys[slot] = key
+        self._values[slot] = alpha - self._min_score + 1
+        return alpha
+
+    def _check_limits(self):
+        """
+        Raises OutOfNodes if the call has searched too many nodes or is
+        past its deadline, and otherwise sets the next node to check at.
+        """
+        if self.max_nodes is not None and self.num_nodes > self.max_nodes:
+            raise OutOfNodes()
+        if self._deadline is not None and monotonic() >= self._deadline:
+            raise OutOfNodes()
+        self._next_check = self._limit(self.num_nodes)
+
+    def _limit(self, num_nodes):
+        """
+        Returns the number of nodes after which the limits must be checked
+        again, num_nodes having been searched.
+        """
+        if self._deadline is not None:
+            limit = num_nodes + _CHECK_EVERY
+            if self.max_nodes is not None and self.max_nodes < limit:
+                limit = self.max_nodes
+            return limit
+        if self.max_nodes is not None:
+            return self.max_nodes
+        return float("inf")
+
+    def _playable(self, mask):
+        """
+        Returns the lowest empty cell of every column that is not full.
+        """
+        return (mask + self._bottom) & self._full
+
+    def _non_losing_moves(self, current, mask):
+        """
+        Returns the cells the player to move can play without letting the
+        opponent win on the next move. The player to move must not be able
+        to win at once.
+        """
+        playable = self._playable(mask)
+        opponent_wins = self._winning_cells(current ^ mask, mask)
+        forced = playable & opponent_wins
+        if forced:
+            if forced & (forced - 1):
+                # Two threats to block: every move loses.
+                return 0
+            playable = forced
+        # Never play right under a cell where the opponent would win.
+        return playable & ~(opponent_wins >> 1)
+
+
+def _half(score):
+    # Rounds towards zero, like the scores themselves.
+    return int(score / 2)
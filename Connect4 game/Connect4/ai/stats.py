@@ -0,0 +1,111 @@
+"""
+These are the statistics of one call to Search.get_best_move(), for a
+search made with collect_stats=True (see ai/uct.py).
+Without it, the search does not look at the clock nor count anything, so
+the statistics cost nothing unless they are asked for.
+
+A SearchStats can be written as one line of JSON, so that the statistics
+of many moves can be appended to the same file and read back line by line.
+"""
+import json
+
+
+class SearchStats:
+    """
+    iterations:             search iterations run.
+    nodes:                  nodes in the tree at the end of the search.
+    max_depth, mean_depth:  depth of the leaves played out from, the root being 0.
+    tree_policy_seconds,
+    default_policy_seconds,
+    back_up_seconds:        time spent in each of the three steps of an iteration.
+    seconds:                time spent in get_best_move().
+    root_visits:            visits of every move at the root.
+    transposition_hit_rate: share of the nodes of the tree that are links to
+                            another node, or None without a transposition table.
+    move:                   the move chosen.
+    solved:                 True if the move was found by the exact solver
+                            rather than by searching.
+    book:                   True if the move was found in the opening book.
+
+    The time of the steps is not measured in the "tree" parallel mode,
+    where the workers cannot send anything back but the shared tree.
+    """
+
+    def __init__(self):
+        self.iterations = 0
+        self.nodes = 0
+        self.max_depth = 0
+        self.total_depth = 0
+        self.tree_policy_seconds = 0.0
+        self.default_policy_seconds = 0.0
+        self.back_up_seconds = 0.0
+        self.seconds = 0.0
+        self.root_visits = {}
+        self.transposition_hit_rate = None
+        self.move = None
+        self.solved = False
+        self.book = False
+
+    def __str__(self):
+        return self.to_json()
+
+    def mean_depth(self):
+        if self.iterations == 0:
+            return 0.0
+        return self.total_depth / self.iterations
+
+    def add(self, other):
+        """
+        Adds the statistics of other, the search of another worker, to these.
+        """
+        self.iterations += other.iterations
+        self.nodes += other.nodes
+        self.max_depth = max(self.max_depth, other.max_depth)
+        self.total_depth += other.total_depth
+        self.tree_policy_seconds += other.tree_policy_seconds
+        self.default_policy_seconds += other.default_policy_seconds
+        self.back_up_seconds += other.back_up_seconds
+        for move, visits in other.root_visits.items():
+            self.root_visits[move] = self.root_visits.get(move, 0) + visits
+
+    def record_tree(self, tree):
+        """
+        Reads the size, the root visits and the transpositions of tree
+        once the search is over.
+        """
+        self.nodes = len(tree)
+        self.root_visits = {}
+        for child in tree.children(0):
+            self.root_visits[tree.move[child]] = tree.num_times_visited[tree.node_of(child)]
+        if tree.transpositions is not None and self.nodes > 1:
+            links = sum(1 for node in range(1, self.nodes) if tree.link[node])
+            self.transposition_hit_rate = links / (self.nodes - 1)
+
+    def to_dict(self):
+        return {
+            "iterations": self.iterations,
+            "nodes": self.nodes,
+            "max_depth": self.max_depth,
+            "mean_depth": self.mean_depth(),
+            "tree_policy_seconds": self.tree_policy_seconds,
+            "default_policy_seconds": self.default_policy_seconds,
+            "back_up_seconds": self.back_up_seconds,
+            "seconds": self.seconds,
+            "root_visits": {str(move): visits for move, visits in sorted(self.root_visits.items())},
+            "transposition_hit_rate": self.transposition_hit_rate,
+            "move": self.move,
+            "solved": self.solved,
+            "book": self.book,
+        }
+
+    def to_json(self):
+        """
+        Returns the statistics as a single line of JSON.
+        """
+        return json.dumps(self.to_dict())
+
+    def write_json_line(self, f):
+        """
+        Appends the statistics to the open file f as one line of JSON.
+        """
+        f.write(self.to_json() + "\n")
@@ -0,0 +1,102 @@
+"""
+This is the transposition table of the UCT search: it maps the canonical
+Zobrist hash of a position (see Board.canonical_key) to the tree node
+that holds its statistics, so that a position reached through different
+move orders, or its mirror image, is searched only once.
+
+Along with the node, the table keeps whether the moves of the node's
+children are those of the canonical position or of its mirror image.
+
+The table has a fixed number of entries. When it is full, an entry has
+to be dropped to make room for a new one; the node itself stays in the
+tree, the position is just no longer shared with new transpositions.
+Two replacement policies are available:
+
+    "depth": a hashed table of fixed slots. On a collision, the entry
+             nearer the root is kept, since its subtree holds more of
+             the search.
+    "lru":   the least recently used entry is dropped.
+"""
+from array import array
+from collections import OrderedDict
+
+
+class TranspositionTable:
+    """
+    Maps position hashes to node indices, with at most size entries.
+    """
+
+    def __init__(self, size, policy="depth"):
+        assert(policy in ("depth", "lru"))
+        self.size = size
+        self.policy = policy
+        if policy == "depth":
+            self._keys = array('Q', bytes(8 * size))
+            self._nodes = array('i', bytes(4 * size))
+            # Depths go up to the number of cells of the board, which can be
+            # more than a byte holds.
+            self._depths = array('H', bytes(2 * size))
+            self._mirrored = array('b', bytes(size))
+        else:
+            self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns (node, mirrored) stored for key, or (0, False) if there is none.
+        """
+        if self.policy == "depth":
+            slot = key % self.size
+            if self._keys[slot] == key and self._nodes[slot]:
+                return self._nodes[slot], self._mirrored[slot] != 0
+            return 0, False
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0, False
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, node, depth, mirrored=False):
+        """
+        Stores node for key. depth is the distance of node from the root,
+        and mirrored is True if the children of node are those of the
+        mirror image of the canonical position.
+        """
+        if self.policy == "depth":
+            slot = key % self.size
+            if self._nodes[slot] == 0 or self._keys[slot] == key \
+                    or depth <= self._depths[slot]:
+                self._keys[slot] = key
+                self._nodes[slot] = node
+                self._depths[slot] = depth
+                self._mirrored[slot] = mirrored
+            return
+
+        self._entries[key] = (node, mirrored)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def remap(self, mapping, depth, mirror=False):
+        """
+        Returns a new table for a re-rooted tree: mapping gives the new
+        index of every node that was kept, and depth is how many moves
+        nearer the root the nodes moved. With mirror, the moves of the
+        new tree are the mirror images of the old ones.
+        Entries of dropped nodes are left out.
+        """
+        table = TranspositionTable(self.size, self.policy)
+        if self.policy == "depth":
+            for slot in range(self.size):
+                node = self._nodes[slot]
+                if node in mapping:
+                    table._keys[slot] = self._keys[slot]
+                    table._nodes[slot] = mapping[node]
+                    table._depths[slot] = max(self._depths[slot] - depth, 0)
+                    table._mirrored[slot] = self._mirrored[slot] != mirror
+            return table
+
+        for key, (node, mirrored) in self._entries.items():
+            if node in mapping:
+                table._entries[key] = (mapping[node], mirrored != mirror)
+        return table
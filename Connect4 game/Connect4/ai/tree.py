@@ -0,0 +1,294 @@
+"""
+This is a search tree stored as columns of numbers instead of Node objects.
+Node number i is described by row i of every column, and the children of
+a node are always stored next to each other:
+
+    children of i = first_child[i], ..., first_child[i] + num_children[i] - 1
+
+The root is node 0, so first_child[i] == 0 means that node i has not
+been expanded yet.
+
+A node does not hold a game state: the search plays the moves of the
+path from the root on a single scratch state, and takes them back after
+the playout.
+
+With a transposition table (see ai/transposition.py) the tree becomes a
+graph: a child whose position is already in the tree is only a link,
+and link[child] is the node that holds its statistics and children.
+node_of() follows these links.
+
+The table also merges a position with its mirror image, whose moves are
+those of the position in reverse order (column c becomes cols - 1 - c).
+mirrored[child] is 1 when the moves stored under node_of(child) are
+those of the mirror image of the position reached by playing
+move[child], so the search has to mirror them while it goes down from
+there (see _tree_policy in ai/uct.py).
+
+A tree made with amaf also has the all-moves-as-first statistics of the
+RAVE search (see _back_up_amaf in ai/uct.py): amaf_visits[child] and
+amaf_reward[child] count the playouts from the parent where the move of
+child was played by the same player, then or later. They belong to the
+child itself, not to node_of(child), since they depend on the parent.
+In the same way, a tree made with priors has the prior of the move of
+every child in prior[child], which the PUCT selection rule weights the
+exploration of the child with.
+
+The columns can live in shared memory, so that several processes can
+search the same tree at once (see _tree_parallel_search in ai/uct.py).
+A shared tree has no transposition table.
+
+The columns of a tree that is not shared start small and double in size
+whenever a node does not fit, up to the capacity of the tree, so a short
+search does not pay for the room a long one would need. Shared columns
+cannot be moved, so a shared tree gets its whole capacity at once.
+"""
+import multiprocessing
+
+from games.board import COLS
+
+# Name, type code and size in bytes of every column.
+_COLUMNS = (
+    ("num_times_visited", 'i', 4),
+    ("total_reward", 'd', 8),
+    ("total_squared_reward", 'd', 8),
+    ("virtual_loss", 'i', 4),
+    ("parent", 'i', 4),
+    ("first_child", 'i', 4),
+    ("num_children", 'b', 1),
+    ("num_tried", 'b', 1),
+    ("move", 'b', 1),
+    ("link", 'i', 4),
+    ("mirrored", 'b', 1),
+    ("proven", 'b', 1),
+)
+
+# Columns of the trees made with amaf only.
+_AMAF_COLUMNS = (
+    ("amaf_visits", 'i', 4),
+    ("amaf_reward", 'd', 8),
+)
+
+# Columns of the trees made with priors only.
+_PRIOR_COLUMNS = (
+    ("prior", 'f', 4),
+)
+
+BYTES_PER_NODE = sum(size for _, _, size in _COLUMNS)
+
+# Columns that are copied as they are when the tree is re-rooted.
+_STAT_COLUMNS = ("num_times_visited", "total_reward", "total_squared_reward", "num_tried",
+                 "proven")
+
+# Nodes a tree that is not shared has room for at first.
+_INITIAL_NODES = 4096
+
+# Statistics of node i in a shared tree are only changed while holding
+# locks[i % _NUM_LOCKS].
+_NUM_LOCKS = 64
+
+
+class Tree:
+    """
+    A tree of at most capacity nodes, with room for allocated of them.
+    A shared tree has a lock for adding nodes and striped locks for
+    changing their statistics; the others have None instead.
+    """
+
+    def __init__(self, capacity, shared=False, transpositions=None, amaf=False, priors=False):
+        assert(not (shared and transpositions))
+        self.capacity = capacity
+        self.allocated = capacity if shared else min(capacity, _INITIAL_NODES)
+        self.transpositions = transpositions
+        self.amaf = amaf
+        self.priors = priors
+        self._buffers = {}
+        for name, code, size in self._columns():
+            if shared:
+                buffer = multiprocessing.RawArray('b', capacity * size)
+            else:
+                buffer = bytearray(self.allocated * size)
+            self._buffers[name] = buffer
+            setattr(self, name, memoryview(buffer).cast('B').cast(code))
+
+        if shared:
+            self._size = multiprocessing.RawValue('i', 1)
+            self._full = multiprocessing.RawValue('b', 0)
+            self.lock = multiprocessing.Lock()
+            self.locks = [multiprocessing.Lock() for _ in range(_NUM_LOCKS)]
+        else:
+            self._size = _Counter(1)
+            self._full = _Counter(0)
+            self.lock = None
+            self.locks = None
+        self.parent[0] = -1
+        self.move[0] = -1
+
+    def __getstate__(self):
+        # Columns are memoryviews, which cannot be pickled. The shared
+        # buffers under them are pickled instead, which multiprocessing
+        # allows when the tree is handed to a new Process.
+        state = self.__dict__.copy()
+        for name, _, _ in self._columns():
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name, code, _ in self._columns():
+            setattr(self, name, memoryview(self._buffers[name]).cast('B').cast(code))
+
+    def _columns(self):
+        return _columns(self.amaf, self.priors)
+
+    def __len__(self):
+        return self._size.value
+
+    def add_children(self, node, moves):
+        """
+        Adds one child per move under node and returns the index of the
+        first one, or 0 when the tree is full.
+        In a shared tree, the caller must hold self.lock.
+        """
+        first = self._size.value
+        if first + len(moves) > self.capacity:
+            self._full.value = 1
+            return 0
+        if first + len(moves) > self.allocated:
+            self._grow(first + len(moves))
+        for i, move in enumerate(moves):
+            self.parent[first + i] = node
+            self.move[first + i] = move
+        self._size.value = first + len(moves)
+        self.num_children[node] = len(moves)
+        # Written last, so that another process that sees the node as
+        # expanded also sees its children.
+        self.first_child[node] = first
+        return first
+
+    def _grow(self, num_nodes):
+        """
+        Makes room for at least num_nodes nodes, doubling the columns as
+        many times as needed but never going over the capacity.
+        Only for trees that are not shared.
+        """
+        allocated = self.allocated
+        while allocated < num_nodes:
+            allocated *= 2
+        allocated = min(allocated, self.capacity)
+        for name, code, size in self._columns():
+            # The old buffer cannot be resized while its column is in
+            # use, so the nodes are copied into a new one.
+            old = self._buffers[name]
+            buffer = bytearray(allocated * size)
+            buffer[:len(old)] = old
+            self._buffers[name] = buffer
+            setattr(self, name, memoryview(buffer).cast('B').cast(code))
+        self.allocated = allocated
+
+    def num_bytes(self):
+        """
+        Returns the bytes taken by the columns of the tree.
+        """
+        return self.allocated * bytes_per_node(self.amaf, self.priors)
+
+    def children(self, node):
+        """
+        Returns the range of the indices of the children of node.
+        """
+        first = self.first_child[node]
+        return range(first, first + self.num_children[node])
+
+    def reroot(self, node, depth, mirror=False, cols=COLS):
+        """
+        Returns a new tree with node as its root, holding only the nodes
+        that can still be reached from it; the others are dropped. The new
+        tree has the same capacity, but only the room its nodes need.
+        depth is the number of moves from the current root to node.
+        With mirror, every move of the new tree is mirrored, for when the
+        moves of node are those of the mirror image of the new position,
+        on a board of cols columns.
+        Only for trees that are not shared.
+        """
+        tree = Tree(self.capacity, amaf=self.amaf, priors=self.priors)
+        mapping = {node: 0}
+        _copy_stats(self, node, tree, 0)
+        to_copy = [node]
+        while to_copy:
+            old = to_copy.pop()
+            if self.first_child[old] == 0:
+                continue
+            children = self.children(old)
+            if mirror:
+                moves = [cols - 1 - self.move[c] for c in children]
+            else:
+                moves = [self.move[c] for c in children]
+            first = tree.add_children(mapping[old], moves)
+            for i, child in enumerate(children):
+                tree.mirrored[first + i] = self.mirrored[child]
+                if self.amaf:
+                    tree.amaf_visits[first + i] = self.amaf_visits[child]
+                    tree.amaf_reward[first + i] = self.amaf_reward[child]
+                if self.priors:
+                    tree.prior[first + i] = self.prior[child]
+                old_node = self.node_of(child)
+                if old_node in mapping:
+                    tree.link[first + i] = mapping[old_node]
+                else:
+                    mapping[old_node] = first + i
+                    _copy_stats(self, old_node, tree, first + i)
+                    to_copy.append(old_node)
+
+        if self.transpositions is not None:
+            tree.transpositions = self.transpositions.remap(mapping, depth, mirror)
+        return tree
+
+    def is_full(self):
+        """
+        Returns True once a node could not be added for lack of room.
+        """
+        return self._full.value != 0
+
+    def node_of(self, child):
+        """
+        Returns the node holding the statistics of child.
+        """
+        link = self.link[child]
+        if link:
+            return link
+        return child
+
+    def stat_lock(self, node):
+        """
+        Returns the lock guarding the statistics of node in a shared tree.
+        """
+        return self.locks[node % _NUM_LOCKS]
+
+
+def bytes_per_node(amaf=False, priors=False):
+    """
+    Returns the size of a node of a tree made with amaf and priors.
+    """
+    return sum(size for _, _, size in _columns(amaf, priors))
+
+
+def _columns(amaf, priors):
+    columns = _COLUMNS
+    if amaf:
+        columns = columns + _AMAF_COLUMNS
+    if priors:
+        columns = columns + _PRIOR_COLUMNS
+    return columns
+
+
+def _copy_stats(source, source_node, tree, node):
+    for name in _STAT_COLUMNS:
+        getattr(tree, name)[node] = getattr(source, name)[source_node]
+
+
+class _Counter:
+    """
+    Stands in for multiprocessing.RawValue when the tree is not shared.
+    """
+
+    def __init__(self, value):
+        self.value = value
@@ -3,144 +3,1309 @@ This is the code for the UCT (Upper Confidence Bounds for Trees)
 algorithm.
 """
 
-from ai.node import Node
-import copy
+from ai import book
+from ai import network
+from ai.budget import DEFAULT_BUDGET
+from ai.solver import Solver, OutOfNodes
+from ai.stats import SearchStats
+from ai.transposition import TranspositionTable
+from ai.tree import Tree, bytes_per_node
+from concurrent.futures import ProcessPoolExecutor
+from games.gamestate import deserialize
 import math
+import multiprocessing
 import random
-from time import process_time
+import threading
+from time import perf_counter
 
+_executor = None
+_executor_num_workers = 0
 
-def get_best_move(cur_state, reward_function):
+# Exploration constant of every selection rule when none is given.
+# We use c = sqrt(2) for UCB1, because that it its theorical value for the MCT.
+_DEFAULT_EXPLORATION = {"ucb1": math.sqrt(2), "ucb1-tuned": 1.0, "puct": 2.0}
+
+# Memory the search tree may grow to (see ai/tree.py). When it is full,
+# new leaves are still played out but no longer added to the tree.
+_TREE_BYTES = 64 * 1024 * 1024
+
+
+def get_best_move(cur_state, reward_function, budget=None, **options):
     """
     With this function, we will try to get the best move.
+    budget is an ai.budget.Budget; without one the search runs for 2
+    seconds of processor time. The other options are those of Search.
+    A new Search is made for every call, so nothing is kept from one move
+    to the next; keep a Search and call its get_best_move() for that.
+    """
+    return Search(reward_function, budget=budget, **options).get_best_move(cur_state)
+
+
+def new_search(cur_state, reward_function, player, **options):
+    """
+    Returns the Search a game keeps for its AI, playing player, from
+    cur_state to the end of the game. It keeps its tree between turns,
+    plays its first moves from the opening book, and its playouts take
+    the winning moves and block the losing ones (see _threat_rollout),
+    unless there is a trained network for the board of cur_state in
+    ai/network.bin, which then evaluates the leaves instead (see
+    ai/network.py). options are more options of Search, such as its budget.
+    """
+    return Search(reward_function, reuse_tree=True, player=player, rollout="threats",
+                  network=network.default_network(cur_state._board.geometry),
+                  opening_book=True, **options)
+
+
+class Search:
+    """
+    This class holds the options of the search and, with reuse_tree, its
+    tree from one move to the next.
+
+    budget (see ai/budget.py) says when a search stops; it can also be
+    given to get_best_move() for a single move.
+
+    num_playouts is the number of random games played from every new leaf.
+    When it is more than one, their mean reward is backed up; the random
+    ones are played together by the NumPy simulator in ai/batch.py, which
+    only pays off from about 32 playouts per leaf.
+
+    rollout is the way the moves of these games are chosen: "random"
+    (every legal move alike) or "threats", which takes a winning move,
+    blocks the opponent's and stops the game as soon as its winner is
+    known (see _threat_rollout). Its games are more like real ones and
+    shorter, but every move costs more.
+
+    num_workers is the number of processes searching at the same time.
+    When it is more than one, parallel_mode chooses between independent
+    trees ("root", see _root_parallel_search) and one shared tree
+    ("tree", see _tree_parallel_search).
+
+    With a transposition_table_size, positions reached by different move
+    orders share one node, and so do a position and its mirror image
+    (see ai/transposition.py for the replacement policies). The shared
+    tree of the "tree" mode has no such table.
+    In every mode, a position that is its own mirror image, such as the
+    empty board, only gets the children of the left half of the columns:
+    the other ones lead to the mirror images of these.
+
+    selection is the rule used to pick a child on the way down: "ucb1",
+    "ucb1-tuned" (which scales the exploration by the variance of the
+    rewards) or "puct" (which weights it by a prior on every move, for now
+    the same for all moves). exploration is the constant c of that rule.
+
+    With a rave_equivalence k, the search also keeps all-moves-as-first
+    statistics (RAVE): every move of a playout, in the tree or out of it,
+    counts for the child of every node on the path that would have filled
+    the same cell for the same player (see _back_up_amaf). The mean reward of a child used by
+    the selection rule is then blended with its AMAF mean, with a weight
+    of sqrt(k / (3 n + k)) for the AMAF mean, n being the visits of the
+    child: the AMAF statistics guide the first visits, and the child's
+    own statistics take over as they pile up (see _rave_mean).
+    The AMAF columns make every node 12 bytes larger, which max_memory
+    does not count.
+
+    With a network (see ai/network.py), the leaves are not played out:
+    they are collected batch_size at a time, with virtual losses to
+    spread them over the tree, and evaluated by the network together.
+    Its value is backed up and its policy gives the priors of the
+    children of the leaf, so the selection rule is always "puct" (see
+    _network_search). num_playouts, rollout and rave_equivalence are then
+    not used, and the search runs in one process or in "root" mode.
+
+    With reuse_tree, the tree is kept after a move. On the next call, the
+    node reached by the moves played since then becomes the new root and
+    the rest of the tree is dropped (see Tree.reroot). Only the search in
+    a single process keeps its tree.
+
+    A Search can also ponder: start_pondering() goes on searching in a
+    background thread while the opponent thinks, and the next
+    get_best_move() stops it and starts from what it found, if the search
+    keeps its tree. This is also the anytime interface: after
+    start_pondering(), best_move() gives the best move found so far
+    whenever it is asked for.
+
+    All the random choices of the search come from its own rng, made from
+    seed. With the same seed and a budget that only counts iterations
+    (or nodes), two searches build exactly the same tree, which is what we
+    need to compare two versions of the code. A parallel search gives
+    every worker a seed drawn from rng, so it is repeatable in "root"
+    mode too; in "tree" mode the workers still race each other.
+
+    With collect_stats, get_best_move() returns the move together with a
+    SearchStats (see ai/stats.py) describing the search, which is also
+    kept in stats.
+
+    player is the symbol whose reward reward_function gives, a number
+    between 0 and 1; the other player's reward is 1 minus it. Every node
+    holds the rewards of the player who made the move leading to it, so
+    that each player picks their own best moves on the way down. Without
+    a player, it is the player to move at the first get_best_move(), or
+    the one not to move at the first start_pondering().
+
+    With opening_book, get_best_move() plays the move of the opening book
+    of ai/book.py when it has one for the position, without searching.
+
+    Once solver_threshold or fewer cells are empty, get_best_move() plays
+    the move of the exact solver of ai/solver.py instead of searching,
+    unless the solver needs more than solver_nodes nodes (0 turns it off)
+    or is still searching when the wall-clock time of the budget is up:
+    its time counts against the budget of the move.
+    Inside the tree, a node whose player has a winning move, or whose
+    every move loses, is marked as proven (see _prove) and is then no
+    longer played out.
+    """
+
+    def __init__(self, reward_function, budget=None, num_playouts=1, num_workers=1,
+                 parallel_mode="root", transposition_table_size=0,
+                 replacement_policy="depth", reuse_tree=False,
+                 selection="ucb1", exploration=None, seed=None, collect_stats=False,
+                 player=None, solver_threshold=18, solver_nodes=100000, rollout="random",
+                 rave_equivalence=0, network=None, batch_size=64, opening_book=False):
+        if network is not None:
+            selection = "puct"
+            assert(num_workers == 1 or parallel_mode == "root")
+        assert(selection in _SELECTIONS)
+        assert(rollout in _ROLLOUTS)
+        self.reward_function = reward_function
+        self.budget = budget if budget is not None else DEFAULT_BUDGET
+        self.num_playouts = num_playouts
+        self.rollout = rollout
+        self.num_workers = num_workers
+        self.parallel_mode = parallel_mode
+        self.transposition_table_size = transposition_table_size
+        self.replacement_policy = replacement_policy
+        self.reuse_tree = reuse_tree
+        self.selection = selection
+        if exploration is None:
+            exploration = _DEFAULT_EXPLORATION[selection]
+        self.exploration = exploration
+        self.rave_equivalence = rave_equivalence
+        self.network = network
+        self.batch_size = batch_size
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.collect_stats = collect_stats
+        self.stats = None
+        self.player = player
+        self.solver_threshold = solver_threshold
+        self.solver_nodes = solver_nodes
+        self.opening_book = opening_book
+        self.tree = None
+        self._solver = None
+        self._root_data = None
+        self._ponder_thread = None
+        self._stop_pondering = None
+
+    def __getstate__(self):
+        # Only the options are sent to worker processes, never the tree.
+        state = self.__dict__.copy()
+        state["tree"] = None
+        state["_root_data"] = None
+        state["_ponder_thread"] = None
+        state["_stop_pondering"] = None
+        state["_solver"] = None
+        return state
+
+    def get_best_move(self, cur_state, budget=None):
+        """
+        We do this in order to get the action that leads to the node child with the best reward (optimal move).
+        Once the search is over, that is the most visited move at the root,
+        as given by best_move().
+        With collect_stats, (move, stats) is returned instead.
+        """
+        self.stop_pondering()
+        if budget is None:
+            budget = self.budget
+        # The time of the solver counts against the budget of the move.
+        budget = budget.fixed()
+        if self.player is None:
+            self.player = cur_state.current_player_symbol()
+        stats = SearchStats() if self.collect_stats else None
+        start = perf_counter()
+
+        best_move = self._book_move(cur_state, stats)
+        if best_move is None:
+            best_move = self._solve(cur_state, stats, budget.deadline)
+        if best_move is None:
+            if self.num_workers > 1:
+                if self.parallel_mode == "tree":
+                    best_move = _tree_parallel_search(self, cur_state, budget, stats)
+                else:
+                    best_move = _root_parallel_search(self, cur_state, budget, stats)
+            else:
+                tree = self._search_from(cur_state, budget, stats)
+                best_move = tree.move[_most_visited_child(tree, 0)]
+                if not self.reuse_tree:
+                    self.tree = None
+
+        if stats is None:
+            return best_move
+        stats.seconds = perf_counter() - start
+        stats.move = best_move
+        self.stats = stats
+        return best_move, stats
+
+    def best_move(self):
+        """
+        Returns the most visited move at the root of the tree, or None
+        before anything has been searched. It can be called while pondering,
+        and is the move get_best_move() plays once its search is over.
+        """
+        tree = self.tree
+        if tree is None or tree.first_child[0] == 0:
+            return None
+        return tree.move[_most_visited_child(tree, 0)]
+
+    def start_pondering(self, game_state, budget=None):
+        """
+        Starts searching the tree of game_state in a background thread,
+        until stop_pondering() or until budget, if given, runs out.
+        This does nothing for a parallel search.
+        """
+        self.stop_pondering()
+        if self.num_workers > 1 or game_state.game_over():
+            return
+        if self.player is None:
+            self.player = 'o' if game_state.current_player_symbol() == 'x' else 'x'
+        tree = self._tree_for(game_state, budget or self.budget)
+        self._stop_pondering = threading.Event()
+        self._ponder_thread = threading.Thread(
+                target=_ponder,
+                args=(self, tree, game_state.clone(), self._stop_pondering, budget),
+                daemon=True)
+        self._ponder_thread.start()
+
+    def stop_pondering(self):
+        """
+        Stops the background search, if there is one, and waits for the
+        iteration it is in to be backed up.
+        """
+        if self._ponder_thread is not None:
+            self._stop_pondering.set()
+            self._ponder_thread.join()
+            self._ponder_thread = None
+            self._stop_pondering = None
+
+    def _book_move(self, game_state, stats=None):
+        """
+        Returns the move of the opening book for game_state, or None if
+        the search has no opening_book or the position is not in it.
+        """
+        if not self.opening_book:
+            return None
+        move = book.lookup(game_state)
+        if move is not None and stats is not None:
+            stats.book = True
+        return move
+
+    def _solve(self, game_state, stats=None, deadline=None):
+        """
+        Returns the move of the exact solver for game_state, or None if
+        there are too many empty cells or the solver gave up, having
+        searched solver_nodes nodes or reached deadline.
+        """
+        if not self.solver_threshold or not self.solver_nodes \
+                or game_state.num_empty_cells() > self.solver_threshold:
+            return None
+        geometry = game_state._board.geometry
+        if self._solver is None or self._solver.geometry is not geometry:
+            self._solver = Solver(geometry, max_nodes=self.solver_nodes)
+        try:
+            move, _ = self._solver.best_move(game_state, deadline)
+        except OutOfNodes:
+            return None
+        if stats is not None:
+            stats.solved = True
+        return move
+
+    def _search_from(self, game_state, budget, stats=None):
+        """
+        Searches the tree of game_state and returns it.
+        """
+        tree = self._tree_for(game_state, budget)
+        state = game_state.clone()
+
+        best_child_of_root = _search_helper(self, tree, state, budget, stats)
+        for _ in range(budget.extensions):
+            if not _child_is_not_most_visited(best_child_of_root, tree):
+                break
+            best_child_of_root = _search_helper(self, tree, state, budget, stats)
+
+        if stats is not None:
+            stats.record_tree(tree)
+        return tree
+
+    def _tree_for(self, game_state, budget):
+        """
+        Returns the tree to search from game_state: the kept tree, re-rooted
+        on the node of game_state when it has one, or else a new tree.
+        """
+        data = game_state.serialize()
+        if self.tree is not None and data.startswith(self._root_data):
+            found = _follow_moves(self.tree, data[len(self._root_data):], game_state)
+            if found is not None:
+                node, flip = found
+                if node != 0 or flip:
+                    self.tree = self.tree.reroot(node, len(data) - len(self._root_data), flip,
+                                                 game_state.num_columns())
+                self._root_data = data
+                return self.tree
+
+        if self.transposition_table_size:
+            transpositions = TranspositionTable(self.transposition_table_size,
+                                                self.replacement_policy)
+        else:
+            transpositions = None
+        self.tree = Tree(_tree_capacity(budget, self), transpositions=transpositions,
+                         amaf=bool(self.rave_equivalence), priors=self.network is not None)
+        self._root_data = data
+        return self.tree
+
+
+def _tree_capacity(budget, search):
+    """
+    The tree may grow to _TREE_BYTES, or less if the budget caps its size.
+    """
+    capacity = _TREE_BYTES // bytes_per_node(bool(search.rave_equivalence),
+                                             search.network is not None)
+    if budget.max_nodes is not None:
+        capacity = min(capacity, budget.max_nodes)
+    return capacity
+
+
+def _follow_moves(tree, moves, state):
+    """
+    Returns (node, flip) for the node reached from the root by playing
+    moves, or None if it is not in the tree. flip is 1 when the moves
+    stored under node are those of the mirror image of the position.
+    state is any state on a board of the same size.
+    """
+    node = 0
+    flip = 0
+    for move in moves:
+        if flip:
+            move = state.mirror_move(move)
+        child = _child_with_move(tree, node, move)
+        if child is None:
+            # A symmetric position only has half of its children, and
+            # the mirror image of the missing one leads to the same place.
+            child = _child_with_move(tree, node, state.mirror_move(move))
+            if child is None:
+                return None
+            flip ^= 1
+        flip ^= tree.mirrored[child]
+        node = tree.node_of(child)
+    return node, flip
+
+
+def _child_with_move(tree, node, move):
+    for child in tree.children(node):
+        if tree.move[child] == move:
+            return child
+    return None
+
+
+def _ponder(search, tree, state, stop, budget):
+    """
+    Runs in the pondering thread until stop is set or budget runs out.
+    """
+    run = budget.start() if budget is not None else None
+    if search.network is not None:
+        _network_search(search, tree, state, run, stop=stop)
+        return
+    rewards = _outcome_rewards(search.reward_function, state)
+    while not stop.is_set() and not tree.proven[0]:
+        if run is not None and not run.within(tree):
+            break
+        _search_iteration(search, tree, state, rewards)
+
+
+def _root_parallel_search(search, game_state, budget, stats=None):
+    """
+    Root parallelisation: every worker process builds its own tree from
+    game_state, then the visits and rewards of the root children are
+    added up move by move and the most visited move is played. A proof
+    found by any worker holds for all of them: a move proven won by one of
+    them is played at once, and the moves proven lost by one of them are
+    only played when every move is.
+    The workers only receive the options and the serialized state, never a tree.
+    The statistics of the workers are added up into stats.
+    """
+    executor = _get_executor(search.num_workers)
+    data = game_state.serialize()
+    worker_budget = budget.split(search.num_workers)
+    jobs = [executor.submit(_root_parallel_worker, search, data, worker_budget,
+                            search.rng.getrandbits(64))
+            for _ in range(search.num_workers)]
+
+    visits = {}
+    rewards = {}
+    proven = {}
+    for job in jobs:
+        children, worker_stats = job.result()
+        if stats is not None:
+            stats.add(worker_stats)
+        for move, num_times_visited, total_reward, move_proven in children:
+            visits[move] = visits.get(move, 0) + num_times_visited
+            rewards[move] = rewards.get(move, 0) + total_reward
+            if move_proven:
+                proven[move] = move_proven
+
+    for move in visits:
+        if proven.get(move) == 1:
+            return move
+    return max(visits, key=lambda move: (proven.get(move) != -1, visits[move],
+                                         rewards[move] / max(visits[move], 1)))
+
+
+def _root_parallel_worker(search, data, budget, seed):
+    """
+    Runs in a worker process. Returns (move, visits, total reward, proven)
+    for every child of the root of an independent search, and the
+    statistics of the search, or None if they are not collected.
     """
-    return _uct_search(cur_state, reward_function)
+    search.rng = random.Random(seed)
+    stats = SearchStats() if search.collect_stats else None
+    tree = search._search_from(deserialize(data), budget, stats)
+    children = [(tree.move[c], tree.num_times_visited[tree.node_of(c)],
+                 tree.total_reward[tree.node_of(c)], tree.proven[tree.node_of(c)])
+                for c in tree.children(0)]
+    return children, stats
 
 
-def _uct_search(game_state, reward_function):
+def _tree_parallel_search(search, game_state, budget, stats=None):
     """
-    We do this in order to get the action that leads to the node child with the best reward (optimal move).
-    """        
-    root = Node(game_state)
-    root.name = "root"
+    Tree parallelisation: the workers all descend the same tree, which is
+    kept in shared memory (see ai/tree.py). Every node on a worker's path
+    gets a virtual loss until the playout is backed up, so the nodes
+    being explored by a worker look worse to the others and they spread
+    over different branches. The workers stop as soon as the root is
+    proven, and the move is chosen as in best_move().
+    Only what can be read from the tree goes into stats.
+    """
+    worker_budget = budget.split(search.num_workers)
+    capacity = _tree_capacity(budget, search)
+    if worker_budget.iterations is not None:
+        # The shared tree is allocated whole, so it is made no larger than
+        # the iterations can fill: each adds the children of one node at most.
+        capacity = min(capacity, 1 + search.num_workers * worker_budget.iterations
+                       * game_state.num_columns())
+    tree = Tree(capacity, shared=True, amaf=bool(search.rave_equivalence))
+    data = game_state.serialize()
+    workers = [multiprocessing.Process(target=_tree_parallel_worker,
+                                       args=(search, tree, data, worker_budget,
+                                             search.rng.getrandbits(64)))
+               for _ in range(search.num_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    if stats is not None:
+        stats.iterations = tree.num_times_visited[0]
+        stats.record_tree(tree)
+    return tree.move[_most_visited_child(tree, 0)]
 
-    best_child_of_root = _search_helper(root, reward_function)
-    while _child_is_not_most_visited(best_child_of_root, root):
-        best_child_of_root = _search_helper(root, reward_function)
 
-    best_move = best_child_of_root.move_that_derived_this_node()
-    return best_move
+def _tree_parallel_worker(search, tree, data, budget, seed):
+    """
+    Runs in a worker process, searching the shared tree until budget runs
+    out or the root is proven.
+    """
+    search.rng = random.Random(seed)
+    state = deserialize(data)
+    rewards = _outcome_rewards(search.reward_function, state)
+    run = budget.start()
+    while not tree.proven[0] and run.within(tree):
+        _search_iteration(search, tree, state, rewards)
 
 
-def _search_helper(root, reward_function):
-    start_time = process_time()
-    while _within_computational_budget(start_time):
-        v = _tree_policy(root)
-        delta = _default_policy(v.state, reward_function)
-        _back_up(v, delta)
-    best_child_of_root = _best_child(root)
+def _get_executor(num_workers):
+    """
+    The process pool is started once and kept for the next moves, unless
+    a different number of workers is asked for.
+    """
+    global _executor
+    global _executor_num_workers
+
+    if _executor is None or _executor_num_workers != num_workers:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = ProcessPoolExecutor(max_workers=num_workers)
+        _executor_num_workers = num_workers
+    return _executor
+
+
+def _search_helper(search, tree, state, budget, stats=None):
+    """
+    Searches until budget runs out or the root is proven.
+    """
+    run = budget.start()
+    rewards = _outcome_rewards(search.reward_function, state)
+    if search.network is not None:
+        _network_search(search, tree, state, run, stats)
+    elif stats is None:
+        while not tree.proven[0] and run.within(tree):
+            _search_iteration(search, tree, state, rewards)
+    else:
+        while not tree.proven[0] and run.within(tree):
+            _timed_search_iteration(search, tree, state, rewards, stats)
+    best_child_of_root = _best_child(search, tree, 0)
     return best_child_of_root
 
 
-def _child_is_not_most_visited(child, root):
-    children = root.children
-    for c in children:
-        if c is not child:
-            if c.num_times_visited > child.num_times_visited:
+def _search_iteration(search, tree, state, rewards):
+    """
+    One descent, playout and back up. state must be the state of the root;
+    it is the same again when this returns. rewards is the reward of
+    every winner (see _outcome_rewards).
+    With AMAF statistics, the moves of the path and of the playout are
+    kept to be backed up too.
+    """
+    player_to_move = state.current_player_symbol() == search.player
+    flips = [] if tree.amaf else None
+    path = _tree_policy(search, tree, state, flips)
+    moves = _moves_of_path(state, path) if tree.amaf else None
+    delta = _evaluate_leaf(search, tree, state, path, rewards, moves)
+    _back_up(tree, path, delta, player_to_move)
+    if tree.amaf:
+        _back_up_amaf(tree, path, flips, moves, delta, player_to_move, state)
+    for _ in range(len(path) - 1):
+        state.undo_turn()
+
+
+def _timed_search_iteration(search, tree, state, rewards, stats):
+    """
+    The same as _search_iteration, but it also times every step and
+    counts the iteration in stats. It is a separate function so that a
+    search without statistics does not pay for them.
+    """
+    player_to_move = state.current_player_symbol() == search.player
+    flips = [] if tree.amaf else None
+    start = perf_counter()
+    path = _tree_policy(search, tree, state, flips)
+    moves = _moves_of_path(state, path) if tree.amaf else None
+    tree_policy_end = perf_counter()
+    delta = _evaluate_leaf(search, tree, state, path, rewards, moves)
+    default_policy_end = perf_counter()
+    _back_up(tree, path, delta, player_to_move)
+    if tree.amaf:
+        _back_up_amaf(tree, path, flips, moves, delta, player_to_move, state)
+    back_up_end = perf_counter()
+    for _ in range(len(path) - 1):
+        state.undo_turn()
+
+    stats.iterations += 1
+    depth = len(path) - 1
+    stats.total_depth += depth
+    if depth > stats.max_depth:
+        stats.max_depth = depth
+    stats.tree_policy_seconds += tree_policy_end - start
+    stats.default_policy_seconds += default_policy_end - tree_policy_end
+    stats.back_up_seconds += back_up_end - default_policy_end
+
+
+def _network_search(search, tree, state, run=None, stats=None, stop=None):
+    """
+    Searches with search.network until run, if given, runs out, stop, if
+    given, is set, or the root is proven. state must be the state of the
+    root; it is the same again when this returns.
+    Every round, batch_size paths are walked down, each leaving a virtual
+    loss on its nodes so that the next ones take other paths. The leaves
+    that are not over are expanded and evaluated by the network in one
+    batch, the priors of their children are set from its policy, and the
+    value of every leaf is backed up.
+    """
+    import numpy as np
+
+    network = search.network
+    rewards = _outcome_rewards(search.reward_function, state)
+    player_to_move = state.current_player_symbol() == search.player
+    if tree.first_child[0] == 0 and not state.game_over() and _expand(tree, 0, state, 1,
+                                                                      search.rng):
+        inputs, legal = network.encode(state)
+        _, priors = network.evaluate(inputs[np.newaxis], legal[np.newaxis])
+        _set_priors(tree, 0, priors[0], 0, state)
+
+    out_of_budget = False
+    while not out_of_budget and not tree.proven[0] and (stop is None or not stop.is_set()):
+        start = perf_counter()
+        paths = []
+        deltas = []
+        leaves = []
+        inputs = []
+        legal = []
+        while len(paths) < search.batch_size and not tree.proven[0]:
+            if run is not None and not run.within(tree):
+                out_of_budget = True
+                break
+            flips = []
+            path = _tree_policy(search, tree, state, flips)
+            for v in path:
+                tree.virtual_loss[v] += 1
+            paths.append(path)
+            delta = _exact_reward(search, tree, state, path, rewards)
+            if delta is None:
+                leaf = path[-1]
+                if tree.first_child[leaf] == 0:
+                    _expand(tree, leaf, state, len(path), search.rng, flips[-1])
+                x, free = network.encode(state)
+                inputs.append(x)
+                legal.append(free)
+                mover = state.current_player_symbol()
+                other = 'o' if mover == 'x' else 'x'
+                leaves.append((len(deltas), leaf, flips[-1],
+                               (rewards[mover], rewards[' '], rewards[other])))
+            deltas.append(delta)
+            for _ in range(len(path) - 1):
+                state.undo_turn()
+        tree_policy_end = perf_counter()
+
+        if inputs:
+            values, priors = network.evaluate(np.array(inputs), np.array(legal))
+            for (i, leaf, flip, outcome_rewards), value, prior in zip(leaves, values, priors):
+                deltas[i] = float(value @ outcome_rewards)
+                if tree.first_child[leaf] != 0:
+                    _set_priors(tree, leaf, prior, flip, state)
+        evaluation_end = perf_counter()
+
+        for path, delta in zip(paths, deltas):
+            for v in path:
+                tree.virtual_loss[v] -= 1
+            _back_up(tree, path, delta, player_to_move)
+
+        if stats is not None:
+            stats.iterations += len(paths)
+            for path in paths:
+                depth = len(path) - 1
+                stats.total_depth += depth
+                stats.max_depth = max(stats.max_depth, depth)
+            stats.tree_policy_seconds += tree_policy_end - start
+            stats.default_policy_seconds += evaluation_end - tree_policy_end
+            stats.back_up_seconds += perf_counter() - evaluation_end
+
+
+def _set_priors(tree, v, priors, flip, state):
+    """
+    Sets the priors of the children of v from priors, the policy of the
+    network for the columns of state. flip is 1 if the moves of v are
+    those of the mirror image of state. When state is its own mirror
+    image, a child also gets the prior of the mirrored column, whose
+    child it stands for.
+    """
+    symmetric = state.is_symmetric()
+    for child in tree.children(v):
+        move = tree.move[child]
+        if flip:
+            move = state.mirror_move(move)
+        prior = priors[move]
+        mirrored = state.mirror_move(move)
+        if symmetric and mirrored != move:
+            prior += priors[mirrored]
+        tree.prior[child] = prior
+
+
+def _most_visited_child(tree, v):
+    """
+    Returns the child of v to play once the search is over: a child proven
+    won if there is one, or else the most visited child that is not proven
+    lost (the most visited one when they all are).
+    The exploration term of the selection rule is left out on purpose: it
+    is there to share the visits out, not to choose the move.
+    """
+    visits = tree.num_times_visited
+    proven = tree.proven
+    best_key = None
+    best_child = None
+    for child in tree.children(v):
+        node = tree.node_of(child)
+        if proven[node] == 1:
+            return child
+        key = (proven[node] != -1, visits[node])
+        if best_key is None or key > best_key:
+            best_key = key
+            best_child = child
+    return best_child
+
+
+def _child_is_not_most_visited(child, tree):
+    visits = tree.num_times_visited
+    for c in tree.children(0):
+        if c != child:
+            if visits[tree.node_of(c)] > visits[tree.node_of(child)]:
                 return True
     return False
 
 
 
-def _back_up(v, delta):
+def _evaluate_leaf(search, tree, state, path, rewards, moves=None):
+    """
+    Returns the reward of search.player for the leaf at the end of path,
+    state being its state. A leaf where the game is won, and so any
+    proven leaf, has an exact reward; the others are played out, and the
+    moves of the playout are added to moves if it is not None.
+    """
+    reward = _exact_reward(search, tree, state, path, rewards)
+    if reward is None:
+        reward = _default_policy(state, search.reward_function, search.num_playouts,
+                                 search.rng, search.rollout, moves, rewards)
+    return reward
+
+
+def _exact_reward(search, tree, state, path, rewards):
+    """
+    Returns the reward of search.player for the leaf at the end of path if
+    it is known without looking further: when the game is over there, or
+    the leaf is proven. Returns None otherwise. rewards is the reward of
+    every winner (see _outcome_rewards).
+    """
+    leaf = path[-1]
+    if not tree.proven[leaf] and len(path) > 1 and state.game_over() and state.winner != ' ':
+        tree.proven[leaf] = 1
+    proven = tree.proven[leaf]
+    if not proven:
+        if state.game_over():
+            return search.reward_function(state)
+        return None
+
+    _prove(tree, path)
+    player_to_move = state.current_player_symbol()
+    if proven == 1:
+        winner = 'o' if player_to_move == 'x' else 'x'
+    else:
+        winner = player_to_move
+    return rewards[winner]
+
+
+def _prove(tree, path):
+    """
+    MCTS-Solver: proven[v] is 1 when the player who moved to v has won,
+    whatever the other does, and -1 when they have lost. The leaf at the
+    end of path is proven; this proves its ancestors that follow from it:
+    a node with a child proven won is lost for the player who moved to
+    it, and one whose every child is proven lost is won.
+    """
+    proven = tree.proven
+    for i in range(len(path) - 1, 0, -1):
+        child = path[i]
+        parent = path[i - 1]
+        if proven[parent]:
+            return
+        if proven[child] == 1:
+            proven[parent] = -1
+        elif all(proven[tree.node_of(c)] == -1 for c in tree.children(parent)):
+            proven[parent] = 1
+        else:
+            return
+
+
+def _back_up(tree, path, delta, player_to_move):
+    """
+    With this function we get, Delta which is the value of the terminal node that we reached through the path.
+    delta is the reward of the search's player; player_to_move is True if
+    that player is the one to move at the root, the first node of path.
+    In a shared tree, this also takes back the virtual losses of the path.
+    """
+    player_moved = not player_to_move
+    if tree.locks is None:
+        for v in path:
+            reward = _delta_function(delta, player_moved)
+            tree.num_times_visited[v] += 1
+            tree.total_reward[v] += reward
+            tree.total_squared_reward[v] += reward * reward
+            player_moved = not player_moved
+        return
+
+    for v in path:
+        reward = _delta_function(delta, player_moved)
+        player_moved = not player_moved
+        with tree.stat_lock(v):
+            tree.virtual_loss[v] -= 1
+            tree.num_times_visited[v] += 1
+            tree.total_reward[v] += reward
+            tree.total_squared_reward[v] += reward * reward
+
+
+def _moves_of_path(state, path):
+    """
+    Returns the moves played on state to go down path from the root.
+    """
+    moves = state._board._moves
+    return moves[len(moves) - (len(path) - 1):]
+
+
+def _back_up_amaf(tree, path, flips, moves, delta, player_to_move, state):
+    """
+    Backs up the all-moves-as-first statistics of an iteration: moves
+    holds the moves played from the root, those of path first, and flips
+    tells for every node of path whether its moves are those of the
+    mirror image (see _tree_policy). state is the state at the end of path.
+    In Connect Four a column is not the same move at every height, so a
+    move counts for the cell it filled: a child of path[i] is updated when
+    the cell its move would fill at path[i] was filled later on by the
+    player to move at path[i], whose reward it gets.
+    """
+    # The heights of the columns at the root, and the cell of every move.
+    heights = list(state._board._heights)
+    for move in moves[:len(path) - 1]:
+        heights[move] -= 1
+    cells = []
+    filled = list(heights)
+    for move in moves:
+        cells.append((move, filled[move]))
+        filled[move] += 1
+
+    player_moving = player_to_move
+    for i, v in enumerate(path):
+        first = tree.first_child[v]
+        if first == 0 or i >= len(moves):
+            break
+        reward = _delta_function(delta, player_moving)
+        played = set(cells[i::2])
+        for child in range(first, first + tree.num_children[v]):
+            move = tree.move[child]
+            if flips[i]:
+                move = state.mirror_move(move)
+            if (move, heights[move]) in played:
+                if tree.locks is None:
+                    tree.amaf_visits[child] += 1
+                    tree.amaf_reward[child] += reward
+                else:
+                    with tree.stat_lock(v):
+                        tree.amaf_visits[child] += 1
+                        tree.amaf_reward[child] += reward
+        heights[moves[i]] += 1
+        player_moving = not player_moving
+
+
+def _rave_mean(tree, child, n, mean, k):
+    """
+    Blends mean, the mean reward of child over its n visits, with its AMAF
+    mean. The weight of the AMAF mean goes from 1 when the child has not
+    been visited down to 0, and is one half after k / 3 visits.
+    """
+    amaf_visits = tree.amaf_visits[child]
+    if amaf_visits == 0:
+        return mean
+    beta = math.sqrt(k / (3 * n + k))
+    return (1.0 - beta) * mean + beta * tree.amaf_reward[child] / amaf_visits
+
+
+def _best_child(search, tree, v):
     """
-    With this function we get, Delta which is the value of the terminal node that we reached through the node V.
+    Returns the child of v with the best value by the selection rule of
+    search. Virtual losses count as visits with no reward.
+    The statistics of a child are those of tree.node_of(child).
+    Every rule picks a child proven won at once and leaves out the
+    children proven lost. With a rave_equivalence, the mean rewards of the
+    children are blended with their AMAF means (see _rave_mean).
     """
-    while v is not None:
-        v.num_times_visited += 1
-        v.total_reward += _delta_function(delta, v)
-        v = v.parent
+    assert(tree.num_children[v] != 0)
+    child = _SELECTIONS[search.selection](tree, v, search.exploration,
+                                          search.rave_equivalence if tree.amaf else 0)
+    if child is None:
+        # Every child is proven lost: play the one that was searched most.
+        visits = tree.num_times_visited
+        child = max(tree.children(v), key=lambda c: visits[tree.node_of(c)])
+    return child
 
 
-def _best_child(v):
-    assert(len(v.children) != 0)
-    c =  math.sqrt(2)
-    #We use c = sqrt(2), because that it its theorical value for the MCT.
+def _ucb1_child(tree, v, c, rave=0):
+    """
+    UCB1: mean reward + c * sqrt(log(N) / n). The log of the parent's
+    visits is taken once for all children. Children not visited yet are
+    left out. rave is the rave_equivalence of the search, 0 without RAVE.
+    """
+    visits = tree.num_times_visited
+    virtual_loss = tree.virtual_loss
+    total_reward = tree.total_reward
+    link = tree.link
+    proven = tree.proven
+    c_sqrt_log_n = c * math.sqrt(math.log(max(visits[v] + virtual_loss[v], 1)))
+    best_value = -math.inf
+    best_child = None
+    first = tree.first_child[v]
+    for child in range(first, first + tree.num_children[v]):
+        v_prime = link[child] or child
+        if proven[v_prime]:
+            if proven[v_prime] == 1:
+                return child
+            continue
+        n = visits[v_prime] + virtual_loss[v_prime]
+        if n == 0:
+            continue
+        mean = total_reward[v_prime] / n
+        if rave:
+            mean = _rave_mean(tree, child, n, mean, rave)
+        value = mean + c_sqrt_log_n / math.sqrt(n)
+        if value > best_value:
+            best_value = value
+            best_child = child
+    return best_child
 
-    def valfunc(v_prime, v):
-        left = v_prime.total_reward / v_prime.num_times_visited
-        right = c * math.sqrt((math.log(v.num_times_visited)) / v_prime.num_times_visited)
-        return left + right
 
-    values_and_nodes = [(valfunc(v_prime, v), v_prime) for v_prime in v.children]
-    max_tup = max(values_and_nodes, key=lambda tup: tup[0])
+def _ucb1_tuned_child(tree, v, c, rave=0):
+    """
+    UCB1-tuned: the exploration term of UCB1 is bounded by an estimate of
+    the variance of the child's rewards, so children whose rewards hardly
+    change are explored less.
+    """
+    visits = tree.num_times_visited
+    virtual_loss = tree.virtual_loss
+    total_reward = tree.total_reward
+    total_squared_reward = tree.total_squared_reward
+    link = tree.link
+    proven = tree.proven
+    log_n = math.log(max(visits[v] + virtual_loss[v], 1))
+    best_value = -math.inf
+    best_child = None
+    first = tree.first_child[v]
+    for child in range(first, first + tree.num_children[v]):
+        v_prime = link[child] or child
+        if proven[v_prime]:
+            if proven[v_prime] == 1:
+                return child
+            continue
+        n = visits[v_prime] + virtual_loss[v_prime]
+        if n == 0:
+            continue
+        mean = total_reward[v_prime] / n
+        variance = total_squared_reward[v_prime] / n - mean * mean \
+                + math.sqrt(2 * log_n / n)
+        if rave:
+            mean = _rave_mean(tree, child, n, mean, rave)
+        value = mean + c * math.sqrt(log_n / n * min(0.25, variance))
+        if value > best_value:
+            best_value = value
+            best_child = child
+    return best_child
+
 
+def _puct_child(tree, v, c, rave=0):
+    """
+    PUCT: mean reward + c * prior * sqrt(N) / (1 + n). Children not
+    visited yet are given the mean reward of v, seen by the player to
+    move at v, so the prior decides which one is tried first. All moves
+    have the same prior, unless the tree has priors (see ai/network.py).
+    With RAVE, an unvisited child that has AMAF statistics gets its AMAF
+    mean instead.
+    """
+    visits = tree.num_times_visited
+    virtual_loss = tree.virtual_loss
+    total_reward = tree.total_reward
+    link = tree.link
+    proven = tree.proven
+    priors = tree.prior if tree.priors else None
+    num_children = tree.num_children[v]
+    n_v = visits[v] + virtual_loss[v]
+    c_sqrt_n = c * math.sqrt(n_v)
+    c_prior_sqrt_n = c_sqrt_n / num_children
+    unvisited_mean = 1.0 - total_reward[v] / n_v if n_v else 0.5
+    best_value = -math.inf
+    best_child = None
+    first = tree.first_child[v]
+    for child in range(first, first + num_children):
+        v_prime = link[child] or child
+        if proven[v_prime]:
+            if proven[v_prime] == 1:
+                return child
+            continue
+        n = visits[v_prime] + virtual_loss[v_prime]
+        mean = total_reward[v_prime] / n if n else unvisited_mean
+        if rave:
+            mean = _rave_mean(tree, child, n, mean, rave)
+        if priors is not None:
+            value = mean + c_sqrt_n * priors[child] / (1 + n)
+        else:
+            value = mean + c_prior_sqrt_n / (1 + n)
+        if value > best_value:
+            best_value = value
+            best_child = child
+    return best_child
 
-    for tup in values_and_nodes:
-        if tup == max_tup:
-            return tup[1]
 
+_SELECTIONS = {"ucb1": _ucb1_child, "ucb1-tuned": _ucb1_tuned_child, "puct": _puct_child}
 
 
-def _choose_untried_action_from(available_actions, already_chosen_actions):
+def _choose_untried_action_from(tree, v):
     """
     This function helps us to choose an un-tried action, rather than a random or uniform one.
+    The children of v are added in a random order (see _expand), so the
+    first one not tried yet is a random untried action.
+    Returns None when every child of v has been tried.
     """
-    actions_to_choose_from = [a for a in available_actions if a not in already_chosen_actions]
-    return random.choice(actions_to_choose_from)
+    tried = tree.num_tried[v]
+    if tried == tree.num_children[v]:
+        return None
+    if tree.locks is None:
+        tree.num_tried[v] = tried + 1
+        return tree.first_child[v] + tried
 
+    with tree.stat_lock(v):
+        tried = tree.num_tried[v]
+        if tried == tree.num_children[v]:
+            return None
+        tree.num_tried[v] = tried + 1
+    return tree.first_child[v] + tried
 
-def _default_policy(game_state, reward_function):
+
+def _default_policy(game_state, reward_function, num_playouts=1, rng=random, rollout="random",
+                    moves=None, rewards=None):
+    """
+    When ever we can not compute the optimal move, we need a default policy.
+    rollout names the one to follow (see _ROLLOUTS), whose choices are
+    drawn from rng. Returns the mean reward of num_playouts playouts.
+    The playouts are made on the given state itself, which is then
+    rewound, so no state is copied.
+    If moves is not None, the moves of the first playout are added to it;
+    the NumPy simulator does not tell its moves.
+    The other rollouts only tell the winner of their games, whose reward
+    is looked up in rewards (see _outcome_rewards). A search works it out
+    once, so that no state is copied per playout either.
+    """
+    if rollout == "random":
+        if num_playouts > 1 and not game_state.game_over():
+            return _batch_default_policy(game_state, reward_function, num_playouts, rng)
+        return _random_rollout(game_state, reward_function, rng, moves)
+
+    if rewards is None:
+        rewards = _outcome_rewards(reward_function, game_state)
+    total_reward = 0.0
+    for i in range(num_playouts):
+        winner = _ROLLOUTS[rollout](game_state, rng, moves if i == 0 else None)
+        total_reward += rewards[winner]
+    return total_reward / num_playouts
+
+
+def _random_rollout(game_state, reward_function, rng=random, moves=None):
     """
-    When ever we can not compute the optimal move, we need a default policy. 
-    A random choice to follow.
+    Plays random moves until the game is over and returns the reward of
+    the finished game. The moves are added to moves if it is not None.
     """
+    num_moves_played = 0
     while not game_state.game_over():
-        action = random.choice(game_state.possible_moves())
-        game_state = copy.deepcopy(game_state)
+        action = rng.choice(game_state.possible_moves())
         game_state.take_turn(action)
-    return reward_function(game_state)
+        num_moves_played += 1
+        if moves is not None:
+            moves.append(action)
+    reward = reward_function(game_state)
+    for _ in range(num_moves_played):
+        game_state.undo_turn()
+    return reward
+
+
+def _threat_rollout(game_state, rng=random, moves=None):
+    """
+    Plays the moves a player would not miss and returns the winner of the
+    game ('x', 'o', or ' ' for a draw): a move that wins at once is taken,
+    a move the opponent would win with is blocked, and the cell right
+    under one where the opponent would win is left alone. The other moves
+    are random.
+    The game stops as soon as its winner is known: when the player to
+    move can win at once, and when every move they have lets the opponent
+    win (two threats to block, or only cells under the opponent's).
+    Since a winning move is always taken, no other move can win, so the
+    game is played on copies of the bitboards of the board, without ever
+    looking for a line or touching game_state. The cells where the
+    opponent would win are also those where they can win on their turn,
+    so they are only worked out once per move.
+    The moves are added to moves if it is not None.
+    """
+    if game_state.game_over():
+        return game_state.winner
+
+    board = game_state._board
+    geometry = board.geometry
+    column_of = geometry.column_of
+    winning_cells = geometry.winning_cells
+    symbol = game_state.current_player_symbol()
+    other = 'o' if symbol == 'x' else 'x'
+    mask = board._bitboards[0] | board._bitboards[1]
+    current = board._bitboards[0 if symbol == 'x' else 1]
+    wins = winning_cells(current, mask)
+    while True:
+        playable = (mask + geometry.bottom) & geometry.full
+        if not playable:
+            return ' '
+        if wins & playable:
+            return symbol
+        opponent = current ^ mask
+        threats = winning_cells(opponent, mask)
+        choices = threats & playable
+        if choices:
+            if choices & (choices - 1):
+                return other
+        else:
+            choices = playable & ~(threats >> 1)
+            if not choices:
+                return other
+
+        if choices & (choices - 1):
+            cells = []
+            while choices:
+                cell = choices & -choices
+                cells.append(cell)
+                choices ^= cell
+            cell = rng.choice(cells)
+        else:
+            cell = choices
+        if moves is not None:
+            moves.append(column_of(cell))
+        current = opponent
+        mask |= cell
+        wins = threats & ~cell
+        symbol, other = other, symbol
+
+
+# The rollouts other than "random" return the winner of their game.
+_ROLLOUTS = {"random": _random_rollout, "threats": _threat_rollout}
+
+
+def _batch_default_policy(game_state, reward_function, num_playouts, rng=random):
+    """
+    Plays num_playouts random games at once and returns their mean reward.
+    """
+    from ai.batch import play_out
+
+    outcomes = play_out(game_state, num_playouts, rng)
+    total_reward = 0.0
+    for winner, count in outcomes.items():
+        if count:
+            total_reward += count * _reward_of_outcome(game_state, reward_function, winner)
+    return total_reward / num_playouts
+
+
+def _outcome_rewards(reward_function, game_state):
+    """
+    Returns the reward of every winner ('x', 'o', or ' ' for a draw) of a
+    game played from game_state. The reward function only looks at the
+    winner of a finished state, so this does not change during a search.
+    """
+    return {winner: _reward_of_outcome(game_state, reward_function, winner)
+            for winner in ('x', 'o', ' ')}
 
 
-def _delta_function(delta, v):
+def _reward_of_outcome(game_state, reward_function, winner):
+    """
+    The reward function looks at a finished state, so we show it a copy of
+    game_state that only differs by its winner.
+    """
+    finished_state = game_state.clone()
+    finished_state.winner = winner
+    return reward_function(finished_state)
+
+
+def _delta_function(delta, player_moved):
     """
     Denotes the component of the reward vector delta associated
-    with the current player p at node v.
+    with the player who moved to the node: delta itself if it is the
+    search's player (player_moved), and otherwise the opponent's reward.
     """
-    return delta
+    if player_moved:
+        return delta
+    return 1.0 - delta
 
 
-def _expand(v):
+def _expand(tree, v, state, depth, rng=random, flip=0):
     """
     This function helps us expand the MC Tree with all possible actions that we can do.
+    All the children of v are added at once, next to each other.
+    When state is its own mirror image, only the moves in the left half of
+    the board are added, the others leading to the same positions mirrored.
+    A child whose position, or its mirror image, is already in the
+    transposition table is linked to the node found there. depth is the
+    distance of the children from the root, and flip is 1 if the moves of
+    v are those of the mirror image of state. rng shuffles the children,
+    which is what makes _choose_untried_action_from pick a random untried
+    action.
+    Returns False if there is no room left in the tree.
     """
-    available_actions = v.available_actions()
-    already_tried = v.already_tried_actions
-    action_to_try = _choose_untried_action_from(available_actions, already_tried)
-    v_prime = v.derive_child(action_to_try)
-    return v_prime
+    moves = state.possible_moves()
+    if state.is_symmetric():
+        moves = [move for move in moves if move <= state.mirror_move(move)]
+    rng.shuffle(moves)
+    if flip:
+        moves = [state.mirror_move(move) for move in moves]
+    if tree.lock is None:
+        if not tree.add_children(v, moves):
+            return False
+        if tree.priors:
+            for child in tree.children(v):
+                tree.prior[child] = 1.0 / len(moves)
+        transpositions = tree.transpositions
+        if transpositions is not None:
+            for child in tree.children(v):
+                move = tree.move[child]
+                if flip:
+                    move = state.mirror_move(move)
+                key, mirrored = state.canonical_key_after(move)
+                node, node_mirrored = transpositions.get(key)
+                if node:
+                    tree.link[child] = node
+                    tree.mirrored[child] = flip ^ mirrored ^ node_mirrored
+                else:
+                    transpositions.put(key, child, depth, flip ^ mirrored)
+        return True
+
+    with tree.lock:
+        if tree.first_child[v] == 0:
+            tree.add_children(v, moves)
+    return tree.first_child[v] != 0
 
 
-def _tree_policy(v):
+def _tree_policy(search, tree, state, flips=None):
     """
     This is a complementary function to the above one.
     Here we check if the node we're in is terminal or not, if not, keep expanding.
+    The moves of the path are played on state, and the path is returned.
+    With PUCT, the prior rather than chance picks the untried child, so
+    its children are all chosen by _best_child.
+    flip is 1 while the moves of the nodes are those of the mirror image
+    of state: it changes every time a mirrored child is gone through.
+    If flips is not None, the flip of every node of the path is added to it.
     """
-    while v.is_non_terminal():
-        if v.is_not_fully_expanded():
-            return _expand(v)
+    v = 0
+    path = [v]
+    flip = 0
+    if flips is not None:
+        flips.append(flip)
+    _add_virtual_loss(tree, v)
+    while not state.game_over() and not tree.proven[v]:
+        if tree.first_child[v] == 0 and not _expand(tree, v, state, len(path),
+                                                    search.rng, flip):
+            # The tree is full: play out from here.
+            break
+        if search.selection == "puct":
+            child = _best_child(search, tree, v)
+            v_prime = tree.node_of(child)
+            untried = tree.num_times_visited[v_prime] + tree.virtual_loss[v_prime] == 0
         else:
-            v = _best_child(v)
-    return v
+            child = _choose_untried_action_from(tree, v)
+            untried = child is not None
+            if not untried:
+                child = _best_child(search, tree, v)
+        v_prime = tree.node_of(child)
+        _add_virtual_loss(tree, v_prime)
+        move = tree.move[child]
+        if flip:
+            move = state.mirror_move(move)
+        state.take_turn(move)
+        flip ^= tree.mirrored[child]
+        if flips is not None:
+            flips.append(flip)
+        path.append(v_prime)
+        v = v_prime
+        if untried:
+            break
+    return path
 
 
-def _within_computational_budget(start):
+def _add_virtual_loss(tree, v):
     """
-    With this function, we can control the time in which our algorithm convergs.
-    The more we add more time to the algorithm, the harder it will be to beat it.
+    In a shared tree, marks v as being explored by this process until
+    the playout going through it is backed up.
     """
-    elapsed_time = process_time() - start
-    return elapsed_time < 2
-
-
-
+    if tree.locks is not None:
+        with tree.stat_lock(v):
+            tree.virtual_loss[v] += 1
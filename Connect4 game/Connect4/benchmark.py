@@ -0,0 +1,331 @@
+"""
+This is the benchmark of the game engine and of the UCT search.
+To use it, you need to execute it like so:
+python3 benchmark.py [--output results.json] [--seconds 1.0]
+                     [--iterations 5000] [--workers 1,2,4] [--seed 0]
+                     [--games 10]
+
+It measures:
+    - how many times per second the board can generate the legal moves,
+      look for four in a row, be deep-copied and be played out at random,
+    - how many search iterations per second the UCT search runs from a
+      few fixed positions, and how much memory it needs at most,
+    - how the number of iterations per second grows with the number of
+      worker processes, in both parallel modes,
+    - how the speed of the board and of the search holds up on larger
+      boards than the 6 x 7 one,
+    - what every rollout policy of the search costs (playouts and search
+      iterations per second) and what it brings: the score of a match of
+      --games games between a search with the "threats" rollout and one
+      with the "random" rollout, with the same number of iterations,
+    - how many leaves per second the network of ai/network.py evaluates
+      in batches of every size, how many iterations per second a search
+      with it runs, and, when ai/network.bin exists, the score of a match
+      between a search with that network and one with the "threats"
+      rollout.
+
+The results are printed as JSON, or written to the --output file, so that
+the numbers of two versions of the code can be compared. The searches run
+on iteration budgets with a fixed seed (see ai/uct.py), so two versions
+that are equally good build the same trees and choose the same moves.
+"""
+
+import argparse
+import copy
+import io
+import json
+import platform
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+
+import ai.uct as uct
+from ai import network
+from ai.budget import Budget
+from games.gamestate import GameState, deserialize, _evaluation_function
+from games.metadata import MetaData
+from gameplay import selfplay
+
+# The positions every benchmark is run on, as the moves played from the
+# empty board. The AI plays 'x' and moves first.
+POSITIONS = {
+    "empty": [],
+    "opening": [3, 3, 2, 4, 3, 2],
+    "middlegame": [3, 3, 3, 3, 2, 4, 4, 2, 5, 1, 1, 5, 2, 2, 4, 4, 0, 6],
+    "endgame": [4, 1, 6, 2, 1, 0, 1, 4, 4, 2, 4, 1, 3, 6, 3, 3, 1, 0, 4, 6,
+                6, 1, 2, 3, 2, 3, 2, 2],
+}
+
+
+# The batch sizes of the network benchmark.
+BATCH_SIZES = [1, 32, 64, 128]
+
+# The (rows, cols, connect) of the boards of the geometry benchmark.
+GEOMETRIES = [(6, 7, 4), (9, 10, 5), (12, 14, 6)]
+
+
+def position(name):
+    """
+    Returns the GameState of the benchmark position called name.
+    """
+    return deserialize(bytes([0]) + bytes(POSITIONS[name]), uct)
+
+
+def per_second(function, seconds):
+    """
+    Calls function again and again for about seconds, and returns the
+    number of calls per second.
+    The clock is only read every few calls, so that reading it costs
+    little next to the calls themselves.
+    """
+    calls = 0
+    batch = 1
+    start = perf_counter()
+    while True:
+        for _ in range(batch):
+            function()
+        calls += batch
+        elapsed = perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+        if elapsed < seconds / 10:
+            batch *= 2
+
+
+def board_benchmarks(seconds, seed):
+    """
+    Returns the speed of the basic operations of the game on every position.
+    """
+    results = {}
+    for name in POSITIONS:
+        state = position(name)
+        rng = random.Random(seed)
+        results[name] = {
+            "possible_moves_per_second": per_second(state.possible_moves, seconds),
+            "four_in_a_row_per_second": per_second(state._board.four_in_a_row, seconds),
+            "deepcopy_per_second": per_second(lambda: copy.deepcopy(state), seconds),
+            "clone_per_second": per_second(state.clone, seconds),
+            "playouts_per_second": per_second(
+                lambda: uct._default_policy(state, _evaluation_function, 1, rng), seconds),
+        }
+    return results
+
+
+def search_benchmarks(iterations, seed, **options):
+    """
+    Runs a search of the given number of iterations from every position.
+    Returns, for every position, the iterations per second, the move
+    chosen, the size of the tree and the peak memory of the search.
+    A position the exact solver answers without searching is marked as
+    solved, and has no iterations per second. A search that proves its
+    root stops early, so its speed is counted on the iterations it ran.
+    The memory includes the columns of the tree, which grow with it
+    (tree_bytes).
+    The memory is measured by a second, identical search, since tracing
+    the allocations slows the search down.
+    """
+    results = {}
+    for name in POSITIONS:
+        state = position(name)
+        budget = Budget(iterations=iterations, extensions=0)
+
+        search = uct.Search(_evaluation_function, budget=budget, reuse_tree=True,
+                            seed=seed, **options)
+        start = perf_counter()
+        move = search.get_best_move(state)
+        elapsed = perf_counter() - start
+
+        tracemalloc.start()
+        uct.Search(_evaluation_function, budget=budget, seed=seed,
+                   **options).get_best_move(state)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # The exact solver finds the moves of the endgames without a tree.
+        tree = search.tree
+        solved = tree is None
+        results[name] = {
+            "solved": solved,
+            "iterations_per_second": None if solved else tree.num_times_visited[0] / elapsed,
+            "move": move,
+            "tree_nodes": 0 if solved else len(tree),
+            "tree_bytes": 0 if solved else tree.num_bytes(),
+            "peak_memory_bytes": peak_memory,
+        }
+    return results
+
+
+def scaling_benchmarks(iterations, worker_counts, seed):
+    """
+    Returns the iterations per second of a search from the empty board
+    for every number of workers, in both parallel modes.
+    The iterations are shared between the workers, so this is the
+    throughput of the whole search, starting the workers included.
+    """
+    state = position("empty")
+    budget = Budget(iterations=iterations, extensions=0)
+    results = {}
+    for mode in ("root", "tree"):
+        results[mode] = {}
+        for num_workers in worker_counts:
+            search = uct.Search(_evaluation_function, budget=budget, seed=seed,
+                                num_workers=num_workers, parallel_mode=mode)
+            if num_workers > 1 and mode == "root":
+                # The process pool is kept from one search to the next, so
+                # it is started before the clock is.
+                uct._get_executor(num_workers)
+            start = perf_counter()
+            search.get_best_move(state)
+            results[mode][num_workers] = iterations / (perf_counter() - start)
+    return results
+
+
+def geometry_benchmarks(seconds, iterations, seed):
+    """
+    Returns, for every board of GEOMETRIES, the speed of a random playout
+    and of looking for a line, and the iterations per second of a search,
+    all from the empty board.
+    """
+    results = {}
+    for rows, cols, connect in GEOMETRIES:
+        metadata = MetaData()
+        metadata.player_symbol = 'o'
+        metadata.ai_symbol = 'x'
+        metadata.rows, metadata.cols, metadata.connect = rows, cols, connect
+        state = GameState(metadata, uct)
+        rng = random.Random(seed)
+        budget = Budget(iterations=iterations, extensions=0)
+        search = uct.Search(_evaluation_function, budget=budget, seed=seed)
+        start = perf_counter()
+        search.get_best_move(state)
+        elapsed = perf_counter() - start
+        results["%dx%dx%d" % (rows, cols, connect)] = {
+            "four_in_a_row_per_second": per_second(state._board.four_in_a_row, seconds),
+            "playouts_per_second": per_second(
+                lambda: uct._default_policy(state, _evaluation_function, 1, rng), seconds),
+            "iterations_per_second": iterations / elapsed,
+        }
+    return results
+
+
+def rollout_benchmarks(seconds, iterations, games, seed):
+    """
+    Returns, for every rollout policy, the playouts per second from every
+    position and the iterations per second of a search from the empty
+    board, and the score of a match of games games between the "threats"
+    and the "random" rollouts. The match is played with a tenth of the
+    iterations per move, so that it does not take too long.
+    """
+    results = {}
+    budget = Budget(iterations=iterations, extensions=0)
+    for rollout in uct._ROLLOUTS:
+        playouts = {}
+        for name in POSITIONS:
+            state = position(name)
+            rng = random.Random(seed)
+            playouts[name] = per_second(
+                lambda: uct._default_policy(state, _evaluation_function, 1, rng, rollout),
+                seconds)
+        search = uct.Search(_evaluation_function, budget=budget, seed=seed, rollout=rollout)
+        start = perf_counter()
+        search.get_best_move(position("empty"))
+        results[rollout] = {
+            "playouts_per_second": playouts,
+            "iterations_per_second": iterations / (perf_counter() - start),
+        }
+
+    engine = "iterations=%d,rollout=%%s" % max(iterations // 10, 1)
+    score = selfplay.run(games, engine % "threats", engine % "random", io.StringIO(),
+                         seed=seed)
+    results["match"] = {"threats": score["a"], "random": score["b"], "draws": score["draw"]}
+    return results
+
+
+def network_benchmarks(seconds, iterations, games, seed):
+    """
+    Returns the leaves per second that a network with random weights
+    encodes and evaluates from the middlegame position, for every batch
+    size of BATCH_SIZES, and the iterations per second of a search with
+    it from the empty board, for every batch size. When ai/network.bin
+    exists, also returns the score of a match of games games between a
+    search with it and one with the "threats" rollout, with a tenth of
+    the iterations per move. Returns None when NumPy is not installed.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+
+    net = network.Network(seed=seed)
+    state = position("middlegame")
+    results = {"leaves_per_second": {}, "iterations_per_second": {}}
+    for batch_size in BATCH_SIZES:
+        def evaluate():
+            inputs = []
+            legal = []
+            for _ in range(batch_size):
+                x, free = net.encode(state)
+                inputs.append(x)
+                legal.append(free)
+            net.evaluate(np.array(inputs), np.array(legal))
+        results["leaves_per_second"][batch_size] = batch_size * per_second(evaluate, seconds)
+
+        search = uct.Search(_evaluation_function, budget=Budget(iterations=iterations, extensions=0),
+                            seed=seed, network=net, batch_size=batch_size)
+        start = perf_counter()
+        search.get_best_move(position("empty"))
+        results["iterations_per_second"][batch_size] = iterations / (perf_counter() - start)
+
+    results["match"] = None
+    if network.default_network(state._board.geometry) is not None:
+        iterations = max(iterations // 10, 1)
+        score = selfplay.run(games, "iterations=%d,network=%s" % (iterations, network.NETWORK_PATH),
+                             "iterations=%d,rollout=threats" % iterations, io.StringIO(),
+                             seed=seed)
+        results["match"] = {"network": score["a"], "threats": score["b"], "draws": score["draw"]}
+    return results
+
+
+def run(seconds=1.0, iterations=5000, worker_counts=(1, 2, 4), seed=0, games=10):
+    """
+    Runs every benchmark and returns the results as a dictionary.
+    """
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seconds": seconds,
+        "iterations": iterations,
+        "seed": seed,
+        "board": board_benchmarks(seconds, seed),
+        "search": search_benchmarks(iterations, seed),
+        "scaling": scaling_benchmarks(iterations, worker_counts, seed),
+        "geometry": geometry_benchmarks(seconds, iterations, seed),
+        "rollout": rollout_benchmarks(seconds, iterations, games, seed),
+        "network": network_benchmarks(seconds, iterations, games, seed),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the game and the UCT search.")
+    parser.add_argument("--output", help="file to write the JSON results to")
+    parser.add_argument("--seconds", type=float, default=1.0,
+                        help="time spent measuring each basic operation")
+    parser.add_argument("--iterations", type=int, default=5000,
+                        help="iterations of every search")
+    parser.add_argument("--workers", default="1,2,4",
+                        help="comma separated numbers of worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--games", type=int, default=10,
+                        help="games of the matches between the rollout policies and "
+                             "with the network")
+    args = parser.parse_args()
+
+    results = run(args.seconds, args.iterations,
+                  [int(n) for n in args.workers.split(",")], args.seed, args.games)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
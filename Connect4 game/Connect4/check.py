@@ -0,0 +1,245 @@
+"""
+These are checks of the fast code of the game against slow code that is
+easy to trust: the bitboards of games/board.py against a scan of every
+line of the board, cell by cell, and the exact solver of ai/solver.py
+against a plain minimax over every game.
+To use it, you need to execute it like so:
+python3 check.py [--games 50] [--positions 60] [--empty 12] [--seed 0]
+
+It plays --games random games on every board of GEOMETRIES and, after
+every move, checks that:
+    - the winner found by Board.place is the one the scan finds,
+    - Geometry.winning_cells gives exactly the empty cells that would
+      complete a line for each player,
+    - undo() gives back the board as it was before the move.
+
+It then draws --positions random positions with --empty empty cells on
+every board of SOLVER_GEOMETRIES, and checks that the score the solver
+gives each of them is the one the minimax finds, and that the move it
+chooses gets that score. The minimax plays every move and looks for
+lines with the scan; it only remembers the positions it has already
+scored, which changes nothing to its answers.
+
+Every mismatch is printed with the moves of its game, and the script
+exits with status 1 if there was any.
+"""
+
+import argparse
+import random
+import sys
+
+from ai.solver import Solver
+from games.board import Board, get_geometry, _INDEX
+
+# The (rows, cols, connect) of the boards the checks are run on.
+GEOMETRIES = [(6, 7, 4), (4, 5, 3), (9, 10, 5), (1, 8, 4), (7, 1, 4), (12, 14, 6)]
+
+# The (rows, cols, connect) of the boards the solver is checked on.
+SOLVER_GEOMETRIES = [(6, 7, 4), (4, 5, 3)]
+
+# (row step, column step) of the four kinds of lines.
+_DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def has_line(board, symbol):
+    """
+    Returns True if symbol has connect in a row on board, by looking at
+    every line of connect cells.
+    """
+    geometry = board.geometry
+    for row in range(geometry.rows):
+        for col in range(geometry.cols):
+            if line_through(board, symbol, row, col):
+                return True
+    return False
+
+
+def line_through(board, symbol, row, col, extra=None):
+    """
+    Returns True if symbol has connect in a row through the cell (row, col),
+    counting the cell extra as theirs too.
+    """
+    geometry = board.geometry
+    if (row, col) != extra and board._symbol_at(row, col) != symbol:
+        return False
+    for dr, dc in _DIRECTIONS:
+        count = 1
+        for sign in (1, -1):
+            r = row + sign * dr
+            c = col + sign * dc
+            while 0 <= r < geometry.rows and 0 <= c < geometry.cols \
+                    and ((r, c) == extra or board._symbol_at(r, c) == symbol):
+                count += 1
+                r += sign * dr
+                c += sign * dc
+        if count >= geometry.connect:
+            return True
+    return False
+
+
+def winning_cells(board, symbol):
+    """
+    Returns the set of the empty cells (row, col) that would complete a
+    line for symbol, whether they can be played now or not.
+    """
+    geometry = board.geometry
+    cells = set()
+    for row in range(geometry.rows):
+        for col in range(geometry.cols):
+            if board._symbol_at(row, col) == ' ' \
+                    and line_through(board, symbol, row, col, (row, col)):
+                cells.add((row, col))
+    return cells
+
+
+def cells_of(bitboard, geometry):
+    """
+    Returns the set of the cells (row, col) set in bitboard.
+    """
+    return {(bit % geometry.h1, bit // geometry.h1)
+            for bit in range(geometry.cols * geometry.h1) if bitboard >> bit & 1}
+
+
+def check_board(num_games, seed):
+    """
+    Plays num_games random games on every board of GEOMETRIES and returns
+    the list of the mismatches found between the bitboards and the scan.
+    """
+    rng = random.Random(seed)
+    errors = []
+    for rows, cols, connect in GEOMETRIES:
+        geometry = get_geometry(rows, cols, connect)
+        for _ in range(num_games):
+            board = Board(rows, cols, connect)
+            symbol = 'x'
+            while True:
+                where = "%d x %d, %d in a row, moves %s" % (rows, cols, connect, board._moves)
+                filled = board._bitboards[0] | board._bitboards[1]
+                for s in ('x', 'o'):
+                    fast = cells_of(geometry.winning_cells(board._bitboards[_INDEX[s]], filled),
+                                    geometry)
+                    if fast != winning_cells(board, s):
+                        errors.append("winning cells of %s: %s" % (s, where))
+
+                there_is_a_winner, winner = board.four_in_a_row()
+                if board.is_full() or there_is_a_winner:
+                    break
+                before = (board._bitboards[:], board._heights[:], board.zobrist_key())
+                move = rng.choice([c for c in range(cols) if board.valid_move(c)])
+                board.place(move, symbol)
+                board.undo()
+                if (board._bitboards, board._heights, board.zobrist_key()) != before:
+                    errors.append("undo of %d: %s" % (move, where))
+                board.place(move, symbol)
+
+                scanned = symbol if has_line(board, symbol) else None
+                if board.four_in_a_row()[1] != scanned:
+                    errors.append("winner after %d: %s" % (move, where))
+                symbol = 'o' if symbol == 'x' else 'x'
+    return errors
+
+
+def minimax_score(board, symbol, scores):
+    """
+    Returns the score of board for symbol, the player to move, with the
+    conventions of ai/solver.py: 0 for a draw, and otherwise positive if
+    they win and negative if they lose, a win with the last stone of the
+    board scoring 1. scores holds the positions already scored.
+    """
+    key = (board._bitboards[0], board._bitboards[1])
+    if key in scores:
+        return scores[key]
+    geometry = board.geometry
+    cells = geometry.rows * geometry.cols
+    other = 'o' if symbol == 'x' else 'x'
+    best = None
+    for move in range(geometry.cols):
+        if not board.valid_move(move):
+            continue
+        score = move_score(board, symbol, other, move, cells, scores)
+        if best is None or score > best:
+            best = score
+    scores[key] = best
+    return best
+
+
+def move_score(board, symbol, other, move, cells, scores):
+    """
+    Returns the score for symbol of playing move on board.
+    """
+    num_moves = board._num_moves
+    board.place(move, symbol)
+    if line_through(board, symbol, board._heights[move] - 1, move):
+        score = (cells + 1 - num_moves) // 2
+    elif board.is_full():
+        score = 0
+    else:
+        score = -minimax_score(board, other, scores)
+    board.undo()
+    return score
+
+
+def check_solver(num_positions, num_empty, seed):
+    """
+    Checks the solver on num_positions random positions with num_empty
+    empty cells on every board of SOLVER_GEOMETRIES, and returns the list
+    of the mismatches found with the minimax.
+    """
+    from games.gamestate import deserialize
+
+    rng = random.Random(seed)
+    errors = []
+    for rows, cols, connect in SOLVER_GEOMETRIES:
+        solver = Solver(get_geometry(rows, cols, connect))
+        for _ in range(num_positions):
+            moves = random_position(rows, cols, connect, num_empty, rng)
+            state = deserialize(bytes([4, rows, cols, connect]) + bytes(moves))
+            symbol = state.current_player_symbol()
+            other = 'o' if symbol == 'x' else 'x'
+            board = state._board
+            move, score = solver.best_move(state)
+
+            scores = {}
+            where = "%d x %d, %d in a row, moves %s" % (rows, cols, connect, moves)
+            expected = minimax_score(board, symbol, scores)
+            if score != expected:
+                errors.append("score %d instead of %d: %s" % (score, expected, where))
+            elif move_score(board, symbol, other, move, rows * cols, scores) != expected:
+                errors.append("move %d does not score %d: %s" % (move, expected, where))
+    return errors
+
+
+def random_position(rows, cols, connect, num_empty, rng):
+    """
+    Returns the moves of a random game of the board that is not over
+    with num_empty empty cells left.
+    """
+    while True:
+        board = Board(rows, cols, connect)
+        symbol = 'x'
+        while not board.four_in_a_row()[0] and board.num_empty_cells() > num_empty:
+            board.place(rng.choice([c for c in range(cols) if board.valid_move(c)]), symbol)
+            symbol = 'o' if symbol == 'x' else 'x'
+        if not board.four_in_a_row()[0]:
+            return board._moves
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the game against slow, simple code.")
+    parser.add_argument("--games", type=int, default=50,
+                        help="random games played on every board")
+    parser.add_argument("--positions", type=int, default=60,
+                        help="random positions the solver is checked on, on every board")
+    parser.add_argument("--empty", type=int, default=12,
+                        help="empty cells of these positions")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    board_errors = check_board(args.games, args.seed)
+    solver_errors = check_solver(args.positions, args.empty, args.seed)
+    for error in board_errors + solver_errors:
+        print(error)
+    print("board: %d mismatches, solver: %d mismatches"
+          % (len(board_errors), len(solver_errors)), file=sys.stderr)
+    if board_errors or solver_errors:
+        exit(1)
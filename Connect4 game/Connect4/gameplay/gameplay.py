@@ -1,5 +1,6 @@
 ai_module = None
 game_module = None
+ponder = False
 
 
 def start_game():
@@ -44,14 +45,23 @@ def start_game():
 
 
 def _do_players_turn():
-    while game_module.needs_more_player_input():
-        info = _get_next_input()
-        invalid_move, err_msg = game_module.info_not_valid(info)
-        while invalid_move:
-            print(err_msg)
+    """
+    With ponder, the AI goes on searching while we wait for the player.
+    """
+    if ponder:
+        game_module.start_pondering()
+    try:
+        while game_module.needs_more_player_input():
             info = _get_next_input()
             invalid_move, err_msg = game_module.info_not_valid(info)
-        game_module.set_next_input(info)
+            while invalid_move:
+                print(err_msg)
+                info = _get_next_input()
+                invalid_move, err_msg = game_module.info_not_valid(info)
+            game_module.set_next_input(info)
+    finally:
+        if ponder:
+            game_module.stop_pondering()
     game_module.take_player_turn()
 
 def _get_next_metadata():
@@ -0,0 +1,254 @@
+"""
+This is a headless arena: two engines play many games against each other,
+without any input() or print(), and every game is written to a file as
+soon as it is over. Games are played in parallel by a pool of processes,
+and every game has its own GameState, so none of the globals of
+games/thegame.py are used.
+
+To use it, run from the folder of main.py:
+python3 -m gameplay.selfplay --games 1000 --engine-a "iterations=2000"
+        --engine-b "iterations=2000,selection=puct" --output games.jsonl
+
+An engine is described by a string of comma separated key=value pairs.
+The keys of ai.budget.Budget (iterations, seconds, cpu_seconds, max_nodes,
+max_memory, extensions) set its budget, and the other keys are options of
+ai.uct.Search, such as selection, exploration, num_playouts, rollout or
+transposition_table_size. network is the path of a weight file of
+ai/network.py, which the search then evaluates its leaves with. The
+engine "random" plays random moves.
+
+'x' always moves first, and the engines swap symbols from one game to the
+next. Every line of the output file is one game, as JSON:
+{"game": 0, "moves": [3, 3, ...], "winner": "x",
+ "seconds": {"x": 1.5, "o": 1.4}, "x": "a", "o": "b"}
+where the winner is ' ' for a draw.
+
+With --records, the games are also written in the binary format of
+games/record.py, with the visits of the root children for every move.
+
+--rows, --cols and --connect play on another board than the 6 x 7 one
+(the binary records are only for the 6 x 7 board).
+"""
+
+import argparse
+import json
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+import ai.uct as uct
+from ai import network
+from ai.budget import Budget
+from games.gamestate import GameState
+from games.metadata import MetaData
+from games.record import GameRecord, RecordWriter
+
+_BUDGET_KEYS = ("iterations", "seconds", "cpu_seconds", "max_nodes", "max_memory",
+                "extensions")
+
+
+class Reward:
+    """
+    The reward function of games/gamestate.py, seen from the side of symbol
+    rather than from the side of the AI, since here both sides are AIs.
+    It is a class rather than a closure so that it can be sent to the
+    worker processes of a parallel search.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+
+    def __call__(self, state):
+        if state.winner == self.symbol:
+            return 1.0
+        elif state.winner == 'x' or state.winner == 'o':
+            return 0.0
+        else:
+            return 0.1
+
+
+class RandomEngine:
+    """
+    Plays a random legal move.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+
+    def get_best_move(self, state):
+        return self.rng.choice(state.possible_moves())
+
+
+def parse_engine(text):
+    """
+    Returns (budget, options) for the engine described by text, or
+    (None, None) for the random engine.
+    """
+    if text.strip() == "random":
+        return None, None
+    budget = {}
+    options = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        key, value = item.split("=", 1)
+        key = key.strip()
+        value = _parse_value(value.strip())
+        if key in _BUDGET_KEYS:
+            budget[key] = value
+        else:
+            options[key] = value
+    return Budget(**budget), options
+
+
+def make_engine(text, symbol, seed):
+    """
+    Returns an engine playing symbol, with a get_best_move(state) method.
+    The engine keeps its tree from one move to the next.
+    """
+    budget, options = parse_engine(text)
+    if budget is None:
+        return RandomEngine(seed)
+    options.setdefault("reuse_tree", True)
+    if "network" in options:
+        options["network"] = network.load(options["network"])
+    return uct.Search(Reward(symbol), budget=budget, seed=seed, player=symbol, **options)
+
+
+def play_game(game, engine_x, engine_o, seed=None, keep_visits=False, geometry=(6, 7, 4)):
+    """
+    Plays one game between the engines described by engine_x and engine_o,
+    and returns its record (see the top of this file). With keep_visits,
+    the record also holds the root visits of every move under "visits".
+    geometry is the (rows, cols, connect) of the board.
+    """
+    metadata = MetaData()
+    metadata.rows, metadata.cols, metadata.connect = geometry
+    metadata.player_symbol = 'o'
+    metadata.ai_symbol = 'x'
+    metadata.player_goes_first = False
+    state = GameState(metadata, uct)
+
+    rng = random.Random(seed)
+    engines = {'x': make_engine(engine_x, 'x', rng.getrandbits(64)),
+               'o': make_engine(engine_o, 'o', rng.getrandbits(64))}
+    seconds = {'x': 0.0, 'o': 0.0}
+    moves = []
+    visits = []
+    while not state.game_over():
+        symbol = state.current_player_symbol()
+        start = perf_counter()
+        move = engines[symbol].get_best_move(state)
+        seconds[symbol] += perf_counter() - start
+        if keep_visits:
+            visits.append(_root_visits(engines[symbol], state))
+        state.take_turn(move)
+        moves.append(move)
+
+    record = {"game": game, "moves": moves, "winner": state.winner, "seconds": seconds}
+    if keep_visits:
+        record["visits"] = visits
+    return record
+
+
+def run(num_games, engine_a, engine_b, output, num_workers=None, seed=0, records=None,
+        geometry=(6, 7, 4)):
+    """
+    Plays num_games games between engine_a and engine_b on num_workers
+    processes (all the processors by default), and writes every game to
+    the open file output as soon as it is over; the games are not written
+    in order. records, if given, is a games.record.RecordWriter the games
+    are also written to. geometry is the (rows, cols, connect) of the board.
+    Returns the number of wins of "a" and "b" and of draws.
+    """
+    score = {"a": 0, "b": 0, "draw": 0}
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        jobs = {}
+        for game in range(num_games):
+            if game % 2 == 0:
+                names = {'x': "a", 'o': "b"}
+                engine_x, engine_o = engine_a, engine_b
+            else:
+                names = {'x': "b", 'o': "a"}
+                engine_x, engine_o = engine_b, engine_a
+            job = executor.submit(play_game, game, engine_x, engine_o, seed + game,
+                                  records is not None, geometry)
+            jobs[job] = names
+
+        for job in as_completed(jobs):
+            names = jobs[job]
+            record = job.result()
+            if records is not None:
+                # The symbols and who moves first are always those of
+                # play_game: the first byte of its GameState.serialize().
+                records.write(GameRecord(0, record["moves"], record["winner"],
+                                         record.pop("visits")))
+            record["x"] = names['x']
+            record["o"] = names['o']
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            if record["winner"] == ' ':
+                score["draw"] += 1
+            else:
+                score[names[record["winner"]]] += 1
+    return score
+
+
+def _root_visits(engine, state):
+    """
+    Returns the visits of every column at the root of the search of
+    engine from state, 0 for the columns it did not search. They are all
+    0 when the move was not searched, for example when the solver found
+    it: the tree of the engine is then still that of an earlier move.
+    """
+    visits = [0] * state.num_columns()
+    tree = getattr(engine, "tree", None)
+    if tree is not None and engine._root_data == state.serialize():
+        for child in tree.children(0):
+            visits[tree.move[child]] = tree.num_times_visited[tree.node_of(child)]
+    return visits
+
+
+def _parse_value(value):
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    if value == "True" or value == "False":
+        return value == "True"
+    return value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plays the AI against itself.")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--engine-a", default="iterations=1000")
+    parser.add_argument("--engine-b", default="iterations=1000")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of games played at the same time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file the games are appended to")
+    parser.add_argument("--records", help="binary game record file the games are appended to")
+    parser.add_argument("--rows", type=int, default=6)
+    parser.add_argument("--cols", type=int, default=7)
+    parser.add_argument("--connect", type=int, default=4)
+    args = parser.parse_args()
+    geometry = (args.rows, args.cols, args.connect)
+    if args.records and geometry != (6, 7, 4):
+        parser.error("--records is only for the 6 x 7 board")
+
+    records = RecordWriter(args.records) if args.records else None
+    try:
+        if args.output:
+            with open(args.output, "a") as f:
+                score = run(args.games, args.engine_a, args.engine_b, f, args.workers,
+                            args.seed, records, geometry)
+        else:
+            score = run(args.games, args.engine_a, args.engine_b, sys.stdout, args.workers,
+                        args.seed, records, geometry)
+    finally:
+        if records is not None:
+            records.close()
+    print("a: %d  b: %d  draws: %d" % (score["a"], score["b"], score["draw"]), file=sys.stderr)
@@ -0,0 +1,339 @@
+"""
+This is a game server: many players play against the AI at the same time,
+each game with its own GameState, over a local TCP or Unix socket.
+gameplay/gameplay.py plays one game through input(); this plays hundreds.
+
+To use it, run from the folder of main.py:
+python3 -m gameplay.server --port 4000 [--host 127.0.0.1]
+or
+python3 -m gameplay.server --unix /tmp/connect4.sock
+
+The protocol is one JSON object per line, both ways. The numbers of a
+request must be JSON numbers: true and false are not numbers here, and
+"first" must be true or false. Every request has a "cmd", and gets
+exactly one reply, in order; the "id" of a request, if it has one, is
+copied into its reply. The requests are:
+
+    {"cmd": "new", "symbol": "x", "first": true,
+     "rows": 6, "cols": 7, "connect": 4, "iterations": 2000, "seconds": 1.0}
+        starts a game. Every key but "cmd" may be left out: the player is
+        'x' and moves first on the 6 x 7 board by default. "iterations"
+        and "seconds" are the budget of every move of the AI in this game,
+        within the limits of the server. When the AI moves first, the
+        reply comes after its move.
+    {"cmd": "move", "game": 1, "column": 3}
+        plays the move of the player, then the move of the AI.
+    {"cmd": "state", "game": 1}
+    {"cmd": "close", "game": 1}
+
+A game belongs to the connection that started it, and is dropped when the
+connection closes. Every successful reply has "ok": true and the state of
+the game:
+
+    {"ok": true, "game": 1, "symbol": "x", "rows": 6, "cols": 7,
+     "connect": 4, "moves": [3, 3], "ai_move": 3, "winner": null}
+
+where "ai_move" is the last move of the AI (null before it has moved) and
+"winner" is 'x', 'o', ' ' for a draw, or null while the game goes on. A
+request that fails gets {"ok": false, "error": "..."} and changes nothing.
+
+The searches of the AI run in a pool of processes, so the event loop only
+ever reads, writes and plays moves, which take microseconds. Every
+connection is answered one request at a time: while the AI of one of its
+games thinks, the server does not read from it, and a client sending too
+fast is slowed down by its socket buffers. At most --max-pending searches
+wait for or run in the pool at once; a move that would go over gets the
+error "busy" and can be sent again later. A move of the AI never searches
+longer than --max-seconds, the exact solver of the endgame included (its
+time counts against the budget of the move, see ai/uct.py), and searches
+never extend their budget (see ai/budget.py), so the reply to a move comes at most about
+(--max-pending / --workers) x --max-seconds after it is sent.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import ai.uct as uct
+from ai.budget import Budget
+from games.gamestate import GameState, deserialize
+from games.metadata import MetaData
+
+# The longest request line the server reads, in bytes.
+MAX_LINE = 4096
+
+# The boards a game may be played on.
+MAX_ROWS = 16
+MAX_COLS = 16
+
+
+class RequestError(Exception):
+    """
+    A request that cannot be carried out. Its message is sent back.
+    """
+
+
+class Game:
+    """
+    One game of one player against the AI: its state, the budget of every
+    move of the AI, and the seed of its searches. Its number is given
+    once it has started.
+    """
+
+    def __init__(self, number, state, budget, seed):
+        self.number = number
+        self.state = state
+        self.budget = budget
+        self.seed = seed
+        self.ai_move = None
+
+    def to_dict(self):
+        state = self.state
+        geometry = state._board.geometry
+        return {
+            "ok": True,
+            "game": self.number,
+            "symbol": state._metadata.player_symbol,
+            "rows": geometry.rows,
+            "cols": geometry.cols,
+            "connect": geometry.connect,
+            "moves": list(state._board._moves),
+            "ai_move": self.ai_move,
+            "winner": state.winner if state.game_over() else None,
+        }
+
+
+class Server:
+    """
+    Serves the games of every connection (see the top of this file).
+    num_workers processes search the moves of the AI (all the processors
+    by default), and at most max_pending searches are waiting for or
+    running in them. A game searches every move for seconds seconds
+    unless it asks for another budget, up to max_seconds and
+    max_iterations. A connection may have max_games games at once.
+    """
+
+    def __init__(self, num_workers=None, max_pending=None, seconds=1.0, max_seconds=5.0,
+                 max_iterations=100000, max_games=16, seed=0):
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=num_workers)
+        self.max_pending = max_pending if max_pending is not None else 4 * num_workers
+        self.seconds = seconds
+        self.max_seconds = max_seconds
+        self.max_iterations = max_iterations
+        self.max_games = max_games
+        self.rng = random.Random(seed)
+        self.pending = 0
+        self.num_games = 0
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        """
+        Answers the requests of one connection until it closes.
+        """
+        games = {}
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await _send(writer, _error("request longer than %d bytes" % MAX_LINE))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                reply = await self._answer(games, line)
+                await _send(writer, reply)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _answer(self, games, line):
+        """
+        Returns the reply to the request line.
+        """
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return _error("not JSON")
+        if not isinstance(request, dict):
+            return _error("not a JSON object")
+        try:
+            reply = await self._carry_out(games, request)
+        except RequestError as e:
+            reply = _error(str(e))
+        except Exception as e:
+            print("error in %r: %r" % (request, e), file=sys.stderr)
+            reply = _error("internal error")
+        if "id" in request:
+            reply["id"] = request["id"]
+        return reply
+
+    async def _carry_out(self, games, request):
+        cmd = request.get("cmd")
+        if cmd == "new":
+            if len(games) >= self.max_games:
+                raise RequestError("too many games on this connection")
+            game = self._new_game(request)
+            if not game.state.players_turn:
+                await self._take_ai_turn(game)
+            self.num_games += 1
+            game.number = self.num_games
+            games[game.number] = game
+            return game.to_dict()
+
+        number = request.get("game")
+        game = games.get(number) if _is_integer(number) else None
+        if game is None:
+            raise RequestError("no such game")
+        if cmd == "move":
+            state = game.state
+            column = request.get("column")
+            if state.game_over():
+                raise RequestError("the game is over")
+            if not _is_integer(column) or column not in state.possible_moves():
+                raise RequestError("not a valid column")
+            state.take_turn(column)
+            if not state.game_over():
+                try:
+                    await self._take_ai_turn(game)
+                except Exception:
+                    state.undo_turn()
+                    raise
+            return game.to_dict()
+        elif cmd == "state":
+            return game.to_dict()
+        elif cmd == "close":
+            del games[game.number]
+            return {"ok": True, "game": game.number}
+        raise RequestError("unknown command")
+
+    def _new_game(self, request):
+        """
+        Returns the game asked for by the "new" request.
+        """
+        metadata = MetaData()
+        symbol = request.get("symbol", 'x')
+        if symbol != 'x' and symbol != 'o':
+            raise RequestError("the symbol must be x or o")
+        metadata.player_symbol = symbol
+        metadata.ai_symbol = 'o' if symbol == 'x' else 'x'
+        first = request.get("first", True)
+        if not isinstance(first, bool):
+            raise RequestError("first must be true or false")
+        metadata.player_goes_first = first
+        metadata.rows = _integer(request, "rows", metadata.rows, 1, MAX_ROWS)
+        metadata.cols = _integer(request, "cols", metadata.cols, 1, MAX_COLS)
+        metadata.connect = _integer(request, "connect", metadata.connect, 2,
+                                    max(metadata.rows, metadata.cols))
+
+        seconds = request.get("seconds", self.seconds)
+        if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) \
+                or not 0 < seconds <= self.max_seconds:
+            raise RequestError("seconds must be more than 0 and at most %s" % self.max_seconds)
+        iterations = _integer(request, "iterations", None, 1, self.max_iterations)
+        budget = Budget(iterations=iterations, seconds=seconds, extensions=0)
+
+        return Game(None, GameState(metadata, uct), budget, self.rng.getrandbits(32))
+
+    async def _take_ai_turn(self, game):
+        """
+        Plays the move of the AI in game, searched in the pool.
+        Raises RequestError("busy") when max_pending searches are already
+        waiting or running.
+        """
+        if self.pending >= self.max_pending:
+            raise RequestError("busy")
+        state = game.state
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            move = await loop.run_in_executor(self.executor, _ai_move, state.serialize(),
+                                              game.budget, game.seed + len(state._board._moves))
+        finally:
+            self.pending -= 1
+        state.take_turn(move)
+        game.ai_move = move
+
+
+def _ai_move(data, budget, seed):
+    """
+    Returns the move of the AI in the state serialized as data. This runs
+    in the worker processes: the search is the one of GameState.take_ai_turn,
+    but it is made for this move only.
+    """
+    state = deserialize(data, uct)
+    return state._new_search(budget=budget, seed=seed).get_best_move(state)
+
+
+def _integer(request, key, default, low, high):
+    if key not in request:
+        return default
+    value = request[key]
+    if not _is_integer(value) or not low <= value <= high:
+        raise RequestError("%s must be an integer from %d to %d" % (key, low, high))
+    return value
+
+
+def _is_integer(value):
+    # json gives bool for true and false, and bool is a kind of int.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _error(message):
+    return {"ok": False, "error": message}
+
+
+async def _send(writer, reply):
+    writer.write((json.dumps(reply) + "\n").encode())
+    await writer.drain()
+
+
+async def serve(server, host="127.0.0.1", port=4000, unix=None):
+    """
+    Serves server on the TCP port of host, or on the Unix socket at the
+    path unix, until the task is cancelled.
+    """
+    if unix is not None:
+        listener = await asyncio.start_unix_server(server.handle, unix, limit=MAX_LINE)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port, limit=MAX_LINE)
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves games against the AI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--unix", help="path of a Unix socket to serve on instead of TCP")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes searching the moves of the AI")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="searches waiting or running at once (4 per worker by default)")
+    parser.add_argument("--seconds", type=float, default=1.0,
+                        help="search time of a move when the game does not choose one")
+    parser.add_argument("--max-seconds", type=float, default=5.0)
+    parser.add_argument("--max-iterations", type=int, default=100000)
+    parser.add_argument("--max-games", type=int, default=16,
+                        help="games a connection may have at once")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = Server(args.workers, args.max_pending, args.seconds, args.max_seconds,
+                    args.max_iterations, args.max_games, args.seed)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -1,37 +1,206 @@
 """
 This is one of the most important codes to run the game.
 This is actually what the user sees when he plays.
+
+The board has rows rows and cols columns, and connect symbols in a row
+win; by default it is the 6 x 7 board of Connect Four. Everything that
+only depends on these three numbers is worked out once per Geometry and
+shared by all the boards of that shape.
+
+The board is stored as two bitboards (one integer per symbol, which
+Python lets grow as large as the board needs) and the height of every
+column. Each column takes rows + 1 bits: the cells from the bottom row
+up, plus one empty guard bit on top so that shifting a line past the top
+of a column can never wrap into the next column.
+
+    bit index = column * (rows + 1) + row
+
+Looking for connect in a row is a few shifts and ANDs of the bitboard
+per direction, whatever the size of the board.
+
+The board also keeps a Zobrist hash of the position: the XOR of one
+random 64 bit number per (symbol, cell) that is filled. It is updated
+with one XOR per move, and two boards with the same cells filled by the
+same symbols have the same hash, whatever the order of the moves.
+
+A position and its mirror image (the columns in reverse order) are worth
+the same, so the board also keeps the hash of its mirror image. The
+smaller of the two is the canonical key of the position, shared by both
+images (see canonical_key).
+
+position_code() gives another key, with no collisions at all, which is
+the same for a position and its mirror image.
 """
 import os
+import random
+
+ROWS = 6
+COLS = 7
+CONNECT = 4
+
+_SYMBOLS = ('x', 'o')
+_INDEX = {'x': 0, 'o': 1}
+
+
+class Geometry:
+    """
+    The shape of a board and the numbers that go with it:
+
+    h1:           bits per column.
+    line_shifts:  for every direction (vertical, horizontal, diagonal "/"
+                  and diagonal "\\"), the shifts that AND-ed one after the
+                  other into a bitboard leave a bit set only where connect
+                  symbols follow each other along that direction.
+    zobrist:      zobrist[symbol index][bit index], seeded so that hashes
+                  are the same in every process and can be stored in files.
+    bottom:       the bottom cell of every column.
+    full:         every cell of the board.
+    column:       the bits of the first column.
+
+    There is only one Geometry of every shape (see get_geometry), which
+    copies and pickles keep.
+    """
+
+    def __init__(self, rows, cols, connect):
+        assert(rows > 0 and cols > 0 and connect > 1)
+        self.rows = rows
+        self.cols = cols
+        self.connect = connect
+        self.h1 = rows + 1
+        self.line_shifts = [_line_shifts(shift, connect)
+                            for shift in (1, self.h1, self.h1 + 1, self.h1 - 1)]
+        rng = random.Random(20180601)
+        self.zobrist = [[rng.getrandbits(64) for _ in range(cols * self.h1)]
+                        for _ in _SYMBOLS]
+        self.bottom = sum(1 << (col * self.h1) for col in range(cols))
+        self.full = self.bottom * ((1 << rows) - 1)
+        self.column = (1 << self.h1) - 1
+        if connect == 4:
+            self.winning_cells = self._winning_cells_of_four
+
+    def __reduce__(self):
+        return get_geometry, (self.rows, self.cols, self.connect)
+
+    def is_default(self):
+        return (self.rows, self.cols, self.connect) == (ROWS, COLS, CONNECT)
+
+    def winning_cells(self, position, mask):
+        """
+        Returns the empty cells, mask being the filled ones, that would
+        complete a line for the player whose cells are position, whether
+        they can be played now or not.
+        """
+        # A cell completes a line along a direction when the stones right
+        # before it and right after it add up to connect - 1. before[n] is
+        # the cells with n stones right before them, and after[n] with n
+        # stones right after them.
+        need = self.connect - 1
+        h1 = self.h1
+
+        # Vertical: the stones can only be under the cell.
+        cells = position << 1
+        for n in range(2, need + 1):
+            cells &= position << n
+
+        for shift in (h1, h1 - 1, h1 + 1):
+            before = [-1]
+            after = [-1]
+            for n in range(1, need + 1):
+                before.append(before[-1] & (position << n * shift))
+                after.append(after[-1] & (position >> n * shift))
+            for n in range(need + 1):
+                cells |= before[n] & after[need - n]
+        return cells & (self.full ^ mask)
+
+    def _winning_cells_of_four(self, position, mask):
+        """
+        The same as winning_cells, written out for four in a row, which is
+        what the exact solver and the playouts spend most of their time in.
+        """
+        h1 = self.h1
+        # Vertical: three stones under the cell.
+        cells = (position << 1) & (position << 2) & (position << 3)
+        for shift in (h1, h1 - 1, h1 + 1):
+            pair = (position << shift) & (position << 2 * shift)
+            cells |= pair & (position << 3 * shift)
+            cells |= pair & (position >> shift)
+            pair = (position >> shift) & (position >> 2 * shift)
+            cells |= pair & (position << shift)
+            cells |= pair & (position >> 3 * shift)
+        return cells & (self.full ^ mask)
+
+    def column_of(self, cell):
+        """
+        Returns the column of cell, a bitboard with a single bit set.
+        """
+        return (cell.bit_length() - 1) // self.h1
+
+
+_geometries = {}
+
+
+def get_geometry(rows=ROWS, cols=COLS, connect=CONNECT):
+    """
+    Returns the Geometry of that shape, made the first time it is asked for.
+    """
+    key = (rows, cols, connect)
+    if key not in _geometries:
+        _geometries[key] = Geometry(rows, cols, connect)
+    return _geometries[key]
+
+
+def _line_shifts(shift, connect):
+    """
+    AND-ing a bitboard with itself shifted by length steps turns runs of
+    length symbols into runs of 2 * length, so a line of connect symbols
+    takes about log2(connect) shifts.
+    """
+    shifts = []
+    length = 1
+    while 2 * length <= connect:
+        shifts.append(length * shift)
+        length *= 2
+    if length < connect:
+        shifts.append((connect - length) * shift)
+    return tuple(shifts)
+
 
 class Board:
     """
     This class represents the game's board.
     """
 
-    def __init__(self):
-        self._rows = []
-        for row_index in range(6):
-            row = [" " for _ in range(7)]
-            self._rows.append(row)
+    def __init__(self, rows=ROWS, cols=COLS, connect=CONNECT):
+        self.geometry = get_geometry(rows, cols, connect)
+        self._bitboards = [0, 0]
+        self._heights = [0 for _ in range(cols)]
+        self._num_moves = 0
+        self._winner = None
+        self._moves_made_to_win = None
+        self._moves = []
+        self._hash = 0
+        self._mirror_hash = 0
 
     def __str__(self):
         nl = os.linesep
+        rows = self.geometry.rows
+        cols = self.geometry.cols
         s = nl
-        for row in reversed(self._rows):
+        for row_index in reversed(range(rows)):
             row_str = ""
-            for spot in row:
+            for col_index in range(cols):
+                spot = self._symbol_at(row_index, col_index)
                 if spot == ' ':
                     row_str += "|___"
                 else:
                     row_str += "|_" + spot + "_"
             row_str += "|" + nl
             s += row_str
-        
-        for i in range(7):
-        	s = ' ___' + s
 
-        rng = [str(i) for i in range(7)]
+        for i in range(cols):
+            s = ' ___' + s
+
+        rng = [str(i) for i in range(cols)]
         nums = "   ".join(rng)
         s += nl + "  " + nums
         return s
@@ -42,8 +211,147 @@ class Board:
         """
         assert(symbol == 'x' or symbol == 'o')
         assert(self.valid_move(move))
+        geometry = self.geometry
         r = self._find_row_from_col(move)
-        self._rows[r][move] = symbol
+        index = _INDEX[symbol]
+        bitboard = self._bitboards[index] | (1 << (move * geometry.h1 + r))
+        self._bitboards[index] = bitboard
+        zobrist = geometry.zobrist[index]
+        self._hash ^= zobrist[move * geometry.h1 + r]
+        self._mirror_hash ^= zobrist[(geometry.cols - 1 - move) * geometry.h1 + r]
+        self._heights[move] = r + 1
+        self._num_moves += 1
+        self._moves.append(move)
+        # There was no line on the board before this move, so any line of
+        # the mover's symbol has to go through the cell that was just filled.
+        if self._winner is None and self._check_for_four(bitboard):
+            self._winner = symbol
+            self._moves_made_to_win = self._num_moves
+
+    def undo(self):
+        """
+        Takes back the last symbol placed on the board and returns its column.
+        """
+        geometry = self.geometry
+        move = self._moves.pop()
+        r = self._heights[move] - 1
+        bit = 1 << (move * geometry.h1 + r)
+        index = 0 if self._bitboards[0] & bit else 1
+        self._bitboards[index] &= ~bit
+        zobrist = geometry.zobrist[index]
+        self._hash ^= zobrist[move * geometry.h1 + r]
+        self._mirror_hash ^= zobrist[(geometry.cols - 1 - move) * geometry.h1 + r]
+        self._heights[move] = r
+        if self._moves_made_to_win == self._num_moves:
+            self._winner = None
+            self._moves_made_to_win = None
+        self._num_moves -= 1
+        return move
+
+    def clone(self):
+        """
+        Returns an independent copy of the board.
+        """
+        result = Board.__new__(Board)
+        result.geometry = self.geometry
+        result._bitboards = self._bitboards[:]
+        result._heights = self._heights[:]
+        result._num_moves = self._num_moves
+        result._winner = self._winner
+        result._moves_made_to_win = self._moves_made_to_win
+        result._moves = self._moves[:]
+        result._hash = self._hash
+        result._mirror_hash = self._mirror_hash
+        return result
+
+    def zobrist_key(self):
+        """
+        Returns the Zobrist hash of the position.
+        """
+        return self._hash
+
+    def zobrist_key_after(self, move, symbol):
+        """
+        Returns the Zobrist hash the position would have after placing
+        symbol in the column move, without placing it.
+        """
+        geometry = self.geometry
+        return self._hash ^ geometry.zobrist[_INDEX[symbol]][move * geometry.h1 + self._heights[move]]
+
+    def canonical_key(self):
+        """
+        Returns (key, mirrored): key is the same for the position and for
+        its mirror image, and mirrored is True when key is the hash of the
+        mirror image rather than of the board itself.
+        """
+        if self._mirror_hash < self._hash:
+            return self._mirror_hash, True
+        return self._hash, False
+
+    def canonical_key_after(self, move, symbol):
+        """
+        Returns canonical_key() as it would be after placing symbol in the
+        column move, without placing it.
+        """
+        geometry = self.geometry
+        r = self._heights[move]
+        zobrist = geometry.zobrist[_INDEX[symbol]]
+        key = self._hash ^ zobrist[move * geometry.h1 + r]
+        mirror_key = self._mirror_hash ^ zobrist[(geometry.cols - 1 - move) * geometry.h1 + r]
+        if mirror_key < key:
+            return mirror_key, True
+        return key, False
+
+    def is_symmetric(self):
+        """
+        Returns True if the position is its own mirror image, in which case
+        the moves in the columns c and cols - 1 - c lead to mirror images.
+        """
+        return self._hash == self._mirror_hash
+
+    def position_code(self, symbol):
+        """
+        Returns (code, mirrored). code is a number that is different for
+        every position, seen by symbol, the player to move: it is the
+        bitboard of symbol plus the bitboard of all the filled cells plus
+        the bottom row, which sets one bit above the top of every column.
+        A position and its mirror image (the columns in reverse order)
+        get the same code, the smaller of their two codes; mirrored is
+        True when it is the code of the mirror image, so a column stored
+        under this code has to be mirrored (cols - 1 - column) back.
+        """
+        geometry = self.geometry
+        mine = self._bitboards[_INDEX[symbol]]
+        filled = self._bitboards[0] | self._bitboards[1]
+        code = mine + filled + geometry.bottom
+        mirror_code = _mirror(mine, geometry) + _mirror(filled, geometry) + geometry.bottom
+        if mirror_code < code:
+            return mirror_code, True
+        return code, False
+
+    def last_move(self):
+        """
+        Returns the column of the last symbol placed, or None on an empty board.
+        """
+        if self._moves:
+            return self._moves[-1]
+        return None
+
+    def winning_cells(self, symbol):
+        """
+        Returns, as a bitboard, the empty cells where symbol would complete
+        a line, whether they can be played now or not.
+        """
+        filled = self._bitboards[0] | self._bitboards[1]
+        return self.geometry.winning_cells(self._bitboards[_INDEX[symbol]], filled)
+
+    def playable_cells(self):
+        """
+        Returns, as a bitboard, the lowest empty cell of every column that
+        is not full.
+        """
+        geometry = self.geometry
+        return ((self._bitboards[0] | self._bitboards[1]) + geometry.bottom) & geometry.full
 
     def four_in_a_row(self):
         """
@@ -51,81 +359,74 @@ class Board:
         Whenever we have 4 marks in a row, the game is over.
         This function returns True if x or if o has four in a row.
         In addition to that, it returns the winner of the game.
+        The answer is kept up to date by place(), so this does not scan the board.
+        """
+        return self._winner is not None, self._winner
+
+    def is_full(self):
         """
-        rows, winner = self._check_for_four(self._rows)
-        if rows:
-            return True, winner
-        cols, winner = self._check_for_four(self._cols())
-        if cols:
-            return True, winner
-        diag, winner = self._check_for_four(self._diagonals())
-        if diag:
-            return True, winner
+        Returns True when every cell of the board has been played.
+        """
+        return self._num_moves == self.geometry.rows * self.geometry.cols
 
-        return False, None
+    def num_empty_cells(self):
+        """
+        Returns the number of cells that have not been played yet.
+        """
+        return self.geometry.rows * self.geometry.cols - self._num_moves
 
     def valid_move(self, move):
         """
         This function checks if the move is valid or not.
         """
-        return not self._column_is_full(move)
+        return 0 <= move < self.geometry.cols and not self._column_is_full(move)
 
-    def _check_for_four(self, ls):
+    def _check_for_four(self, bitboard):
         """
         This function actually completes the four in a row function.
-        Here we check in there are 4 succesive marks, wether its in columns, raw, or diagonal. 
-        """
-        for row_col_or_diag in ls:
-            num_in_a_row = 0
-            last_seen = None
-            for spot in row_col_or_diag:
-                if spot == last_seen and spot != ' ':
-                    num_in_a_row += 1
-                else:
-                    last_seen = spot
-                    num_in_a_row = 1
-                if num_in_a_row >= 4:
-                    return True, last_seen
-        return False, ' '
+        For every direction, AND-ing the board with itself shifted along
+        it (by one and then by two steps for four in a row) leaves a bit
+        set only where connect marks follow each other on a line.
+        """
+        for shifts in self.geometry.line_shifts:
+            line = bitboard
+            for shift in shifts:
+                line &= line >> shift
+            if line:
+                return True
+        return False
 
     def _column_is_full(self, col_index):
         """
-        When the column is full, we can not add more marks to it. 
-        With this function we check if a column is full or not. 
+        When the column is full, we can not add more marks to it.
+        With this function we check if a column is full or not.
         """
-        column = [row[col_index] for row in self._rows]
-        for spot in column:
-            if spot == ' ':
-                return False
-        return True
-
-    def _cols(self):
-        for i in range(7):
-            yield [row[i] for row in self._rows]
-
-    def _diagonals(self):
-        for j in range(3, 9):
-            yield [self._rows[i][j - i] for i in range(len(self._rows))\
-                    if (j - i) < 7 and (j - i) >= 0]
-
-        for j in range(-2, 3):
-            yield [self._rows[i][i + j] for i in range(len(self._rows))\
-                    if (i + j) < 7 and (i + j) >= 0]
+        return self._heights[col_index] >= self.geometry.rows
 
     def _find_row_from_col(self, col_index):
         """
         Finds the right row from the given column
         """
-        column = [row[col_index] for row in self._rows]
-        for i, spot in enumerate(column):
-            # Looking from the bottom row up
-            if spot == ' ':
-                return i
-
-
-
-
-
+        return self._heights[col_index]
 
+    def _symbol_at(self, row_index, col_index):
+        """
+        Returns the symbol in the given cell, or ' ' if the cell is empty.
+        """
+        bit = 1 << (col_index * self.geometry.h1 + row_index)
+        for symbol in _SYMBOLS:
+            if self._bitboards[_INDEX[symbol]] & bit:
+                return symbol
+        return ' '
 
 
+def _mirror(bitboard, geometry):
+    """
+    Returns the bitboard with its columns in reverse order.
+    """
+    h1 = geometry.h1
+    last = geometry.cols - 1
+    result = 0
+    for col in range(geometry.cols):
+        result |= ((bitboard >> (col * h1)) & geometry.column) << ((last - col) * h1)
+    return result
@@ -1,5 +1,6 @@
 import copy
 from games.board import Board
+from games.metadata import MetaData
 import os
 
 class GameState:
@@ -9,7 +10,8 @@ class GameState:
     def __init__(self, metadata, ai):
         self._metadata = metadata
         self._ai = ai
-        self._board = Board()
+        self._search = None
+        self._board = Board(metadata.rows, metadata.cols, metadata.connect)
         self.players_turn = self._metadata.player_goes_first
         self._incoming_move = None
         self._move_that_derived_this_state = None
@@ -26,18 +28,101 @@ class GameState:
         result = cls.__new__(cls)
         memo[id(self)] = result
         for k, v in self.__dict__.items():
-            if k == "_ai":
+            if k == "_ai" or k == "_search":
                 setattr(result, k, v)
             else:
                 setattr(result, k, copy.deepcopy(v, memo))
         return result
 
+    def clone(self):
+        """
+        Returns a copy of this state that can be played on independently.
+        The metadata and the AI are never changed by a move, so the copy
+        shares them instead of copying them.
+        """
+        result = GameState.__new__(GameState)
+        result._metadata = self._metadata
+        result._ai = self._ai
+        result._search = None
+        result._board = self._board.clone()
+        result.players_turn = self.players_turn
+        result._incoming_move = self._incoming_move
+        result._move_that_derived_this_state = self._move_that_derived_this_state
+        result.winner = self.winner
+        return result
+
+    def serialize(self):
+        """
+        Returns the state as a few bytes, so it can be sent to another process.
+        The first byte holds the symbols and who played first, and every
+        following byte is one move of the game so far. A board that is not
+        the 6 x 7 one has its rows, columns and connect length in the three
+        bytes after the first one.
+        """
+        moves = self._board._moves
+        geometry = self._board.geometry
+        first_players_turn = self.players_turn != (len(moves) % 2 == 1)
+        header = 0
+        if self._metadata.player_symbol == 'x':
+            header |= 1
+        if first_players_turn:
+            header |= 2
+        if not geometry.is_default():
+            header |= 4
+            return bytes([header, geometry.rows, geometry.cols, geometry.connect]) + bytes(moves)
+        return bytes([header]) + bytes(moves)
+
+    def position_key(self):
+        """
+        Returns a hash of the position (see Board.zobrist_key).
+        """
+        return self._board.zobrist_key()
+
+    def position_key_after(self, move):
+        """
+        Returns the hash the position would have after the current player
+        plays move.
+        """
+        return self._board.zobrist_key_after(move, self.current_player_symbol())
+
+    def canonical_key_after(self, move):
+        """
+        Returns the key, shared with its mirror image, that the position
+        would have after the current player plays move, and whether it is
+        the key of the mirror image (see Board.canonical_key).
+        """
+        return self._board.canonical_key_after(move, self.current_player_symbol())
+
+    def num_columns(self):
+        """
+        Returns the number of columns of the board.
+        """
+        return self._board.geometry.cols
+
+    def mirror_move(self, move):
+        """
+        Returns the column move becomes in the mirror image of the board.
+        """
+        return self._board.geometry.cols - 1 - move
+
+    def num_empty_cells(self):
+        """
+        Returns the number of cells left to play.
+        """
+        return self._board.num_empty_cells()
+
+    def is_symmetric(self):
+        """
+        Returns True if the position is its own mirror image.
+        """
+        return self._board.is_symmetric()
+
     def current_player_symbol(self):
         """
         This function is developped to get the current player's symbol
         """
         if self.players_turn:
-            return self._metadata.players_symbol
+            return self._metadata.player_symbol
         else:
             return self._metadata.ai_symbol
 
@@ -48,7 +133,7 @@ class GameState:
         """
         there_is_a_winner, winner = self._board.four_in_a_row()
         self.winner = winner
-        if len(self.possible_moves()) == 0:
+        if not there_is_a_winner and self._board.is_full():
             there_is_a_winner = True
             self.winner = ' '
         return there_is_a_winner
@@ -77,15 +162,16 @@ class GameState:
         This function returns True if the players mouvement is valid.
         Otherwise it displays a message.
         """
+        last = self._board.geometry.cols - 1
         try:
             item = int(info)
             if not self._board.valid_move(item):
-                return False, "Please enter a valid column between 0 and 6 "\
-                        "that isn't full."
+                return False, "Please enter a valid column between 0 and %d "\
+                        "that isn't full." % last
             else:
                 return True, ""
         except ValueError:
-            return False, "Please enter a valid column between 0 and 6."
+            return False, "Please enter a valid column between 0 and %d." % last
 
     def needs_more_player_input(self):
         """
@@ -110,8 +196,12 @@ class GameState:
     def take_ai_turn(self):
         """
         Now, it's time for the computer to play.
+        The search is kept for the whole game, so that what it learned on
+        one turn is used on the next ones.
         """
-        move = self._ai.get_best_move(self, _evaluation_function)
+        if self._search is None:
+            self._search = self._new_search()
+        move = self._search.get_best_move(self)
         self._board.place(move, self._metadata.ai_symbol)
         self._move_that_derived_this_state = move
         print('--------------------------------------------------------')
@@ -121,6 +211,29 @@ class GameState:
         self._incoming_move = None
         self.players_turn = True
 
+    def start_pondering(self):
+        """
+        Lets the AI go on searching while the player thinks.
+        """
+        if self._search is None:
+            self._search = self._new_search()
+        self._search.start_pondering(self)
+
+    def _new_search(self, **options):
+        """
+        Returns the search the AI module makes for the game (see new_search
+        in ai/uct.py); options are more options of it, such as its budget.
+        """
+        return self._ai.new_search(self, _evaluation_function, self._metadata.ai_symbol,
+                                   **options)
+
+    def stop_pondering(self):
+        """
+        Stops the search started by start_pondering().
+        """
+        if self._search is not None:
+            self._search.stop_pondering()
+
     def take_turn(self, move):
         """
         This function can be used to take a turn when the caller does
@@ -135,6 +248,17 @@ class GameState:
         self._move_that_derived_this_state = move
         self._incoming_move = None
 
+    def undo_turn(self):
+        """
+        Takes back the last move, whoever played it.
+        This is the reverse of take_turn().
+        """
+        self._board.undo()
+        self.players_turn = not self.players_turn
+        self._move_that_derived_this_state = self._board.last_move()
+        self._incoming_move = None
+        self.winner = None
+
     def take_player_turn(self):
         """
         Takes the player's turn.
@@ -147,13 +271,31 @@ class GameState:
 
     def _action_set(self):
         """
-        This function generates all possible 6 actions that the computer can play.
-        It does not care wether the action is valid or not.
+        This function generates all possible actions that the computer can play,
+        one per column. It does not care wether the action is valid or not.
         """
-        for c in range(7):
+        for c in range(self._board.geometry.cols):
             yield c
 
 
+def deserialize(data, ai=None):
+    """
+    Rebuilds a GameState from the bytes returned by GameState.serialize().
+    """
+    metadata = MetaData()
+    metadata.player_symbol = 'x' if data[0] & 1 else 'o'
+    metadata.ai_symbol = 'o' if data[0] & 1 else 'x'
+    metadata.player_goes_first = bool(data[0] & 2)
+    moves = data[1:]
+    if data[0] & 4:
+        metadata.rows, metadata.cols, metadata.connect = data[1], data[2], data[3]
+        moves = data[4:]
+    state = GameState(metadata, ai)
+    for move in moves:
+        state.take_turn(move)
+    return state
+
+
 def _evaluation_function(state):
     """
     This is the reward function.
@@ -7,6 +7,9 @@ class MetaData:
         self.player_symbol = None
         self.player_goes_first = False
         self.ai_symbol = None
+        self.rows = 6
+        self.cols = 7
+        self.connect = 4
 
     def get_next_request_str(self):
         if not self.player_symbol:
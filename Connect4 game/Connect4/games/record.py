@@ -0,0 +1,255 @@
+"""
+This is a compact binary file format for finished (or unfinished) games.
+
+A file starts with the 4 bytes b"C4GR" and a version byte, followed by
+one record per game. A record is:
+
+    header  4 bytes: the first byte of GameState.serialize() (who plays
+                     which symbol and who moved first), the number of
+                     moves, the result and the flags.
+    moves   2 moves per byte, the first one in the low 4 bits.
+    visits  only if the VISITS flag is set: for every move, the number
+            of visits of every column at the root of the search that
+            chose it, as COLS unsigned 32 bit integers.
+
+A game of 42 moves takes 25 bytes without visits. The records can be read
+one after the other with read_records(), or in any order with a
+RecordFile, which maps the file in memory and finds record n through an
+index of the offsets of the records. RecordWriter writes that index next
+to the file (path + ".idx") when it is closed, so it does not have to be
+rebuilt every time the file is opened.
+"""
+import mmap
+import os
+import struct
+from array import array
+
+from games.board import COLS
+from games.gamestate import deserialize
+
+MAGIC = b"C4GR"
+VERSION = 1
+
+_FILE_HEADER = struct.Struct("<4sB")
+_HEADER = struct.Struct("<BBBB")
+
+# Flags of a record.
+VISITS = 1
+
+# Result byte of every value of GameState.winner.
+_RESULTS = {' ': 0, 'x': 1, 'o': 2, None: 3}
+_WINNERS = {result: winner for winner, result in _RESULTS.items()}
+
+
+class GameRecord:
+    """
+    One game: state_header is the first byte of GameState.serialize(),
+    moves the columns played, winner as in GameState.winner (None if the
+    game is not over), and visits, if it is not None, one list of COLS
+    visit counts per move.
+    """
+
+    def __init__(self, state_header, moves, winner=None, visits=None):
+        assert(visits is None or len(visits) == len(moves))
+        self.state_header = state_header
+        self.moves = list(moves)
+        self.winner = winner
+        self.visits = visits
+
+    def __eq__(self, other):
+        return isinstance(other, GameRecord) and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return "GameRecord(%d, %r, %r, %r)" % (self.state_header, self.moves,
+                                               self.winner, self.visits)
+
+    @classmethod
+    def from_state(cls, state, visits=None):
+        """
+        Returns the record of the game played so far in state, which
+        must be on the 6 x 7 board.
+        """
+        assert(state._board.geometry.is_default())
+        data = state.serialize()
+        winner = state.winner if state.game_over() else None
+        return cls(data[0], data[1:], winner, visits)
+
+    def replay(self, ai=None, num_moves=None):
+        """
+        Returns the GameState after the first num_moves moves of the game,
+        or after all of them.
+        """
+        moves = self.moves if num_moves is None else self.moves[:num_moves]
+        return deserialize(bytes([self.state_header]) + bytes(moves), ai)
+
+    def to_bytes(self):
+        flags = VISITS if self.visits is not None else 0
+        data = bytearray(_HEADER.pack(self.state_header, len(self.moves),
+                                      _RESULTS[self.winner], flags))
+        data += _pack_moves(self.moves)
+        if self.visits is not None:
+            for counts in self.visits:
+                data += array('I', counts).tobytes()
+        return bytes(data)
+
+
+def record_size(header):
+    """
+    Returns the number of bytes of the record starting with header, the
+    header included.
+    """
+    _, num_moves, _, flags = _HEADER.unpack(header)
+    size = _HEADER.size + (num_moves + 1) // 2
+    if flags & VISITS:
+        size += num_moves * COLS * 4
+    return size
+
+
+def from_bytes(data, offset=0):
+    """
+    Returns the record stored in data at offset.
+    """
+    state_header, num_moves, result, flags = _HEADER.unpack_from(data, offset)
+    offset += _HEADER.size
+    moves = _unpack_moves(data[offset:offset + (num_moves + 1) // 2], num_moves)
+    offset += (num_moves + 1) // 2
+    visits = None
+    if flags & VISITS:
+        counts = array('I', bytes(data[offset:offset + num_moves * COLS * 4]))
+        visits = [list(counts[i * COLS:(i + 1) * COLS]) for i in range(num_moves)]
+    return GameRecord(state_header, moves, _WINNERS[result], visits)
+
+
+class RecordWriter:
+    """
+    Appends records to the file at path, creating it if needed.
+    Use it in a with statement, or call close() at the end, which also
+    writes the index of the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._offsets = _read_index(path)
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(_FILE_HEADER.pack(MAGIC, VERSION))
+        elif self._offsets is None:
+            self._offsets = _scan(path)
+
+        if self._offsets is None:
+            self._offsets = array('Q')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record):
+        self._offsets.append(self._file.tell())
+        self._file.write(record.to_bytes())
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        with open(self.path + ".idx", "wb") as f:
+            self._offsets.tofile(f)
+
+
+def read_records(path):
+    """
+    Yields the records of the file at path one by one, without reading
+    the whole file at once.
+    """
+    with open(path, "rb") as f:
+        _check_file_header(f.read(_FILE_HEADER.size))
+        while True:
+            header = f.read(_HEADER.size)
+            if not header:
+                return
+            body = f.read(record_size(header) - _HEADER.size)
+            yield from_bytes(header + body)
+
+
+class RecordFile:
+    """
+    Gives access to record n of the file at path without reading the
+    records before it. The file is mapped in memory, so only the pages of
+    the records that are read are loaded.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        _check_file_header(self._map[:_FILE_HEADER.size])
+        offsets = _read_index(path)
+        if offsets is None or (offsets and offsets[-1] >= len(self._map)):
+            offsets = _scan(path)
+        self._offsets = offsets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, n):
+        return from_bytes(self._map, self._offsets[n])
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def _pack_moves(moves):
+    data = bytearray((len(moves) + 1) // 2)
+    for i, move in enumerate(moves):
+        data[i // 2] |= move << (4 * (i % 2))
+    return data
+
+
+def _unpack_moves(data, num_moves):
+    return [(data[i // 2] >> (4 * (i % 2))) & 0xF for i in range(num_moves)]
+
+
+def _check_file_header(data):
+    magic, version = _FILE_HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a game record file of version %d" % VERSION)
+
+
+def _read_index(path):
+    """
+    Returns the offsets stored in the index of the file at path, or None
+    if there is no index or it is older than the file.
+    """
+    index_path = path + ".idx"
+    if not os.path.exists(index_path) or not os.path.exists(path) \
+            or os.path.getmtime(index_path) < os.path.getmtime(path):
+        return None
+    offsets = array('Q')
+    with open(index_path, "rb") as f:
+        offsets.frombytes(f.read())
+    return offsets
+
+
+def _scan(path):
+    """
+    Returns the offsets of the records of the file at path, found by
+    reading the header of every record.
+    """
+    offsets = array('Q')
+    with open(path, "rb") as f:
+        _check_file_header(f.read(_FILE_HEADER.size))
+        offset = _FILE_HEADER.size
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return offsets
+            offsets.append(offset)
+            offset += record_size(header)
+            f.seek(offset)
@@ -110,6 +110,20 @@ def set_next_metadata(d):
     _metadata.set_next_metadata(d)
 
 
+def start_pondering():
+    """
+    This function lets the computer think while the player chooses a move.
+    """
+    _gamestate.start_pondering()
+
+
+def stop_pondering():
+    """
+    This function stops the thinking started by start_pondering().
+    """
+    _gamestate.stop_pondering()
+
+
 def take_ai_turn():
     """
     This function modifies the game state in order that the computer take his turn.
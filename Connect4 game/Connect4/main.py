@@ -1,9 +1,14 @@
 """
 This is the main entry point into the game framework.
 To use it, you need to execute it like so:
-python3 main.py path/to/game path/to/AI
+python3 main.py path/to/game path/to/AI [--ponder]
+With --ponder, the AI keeps thinking while the player chooses a move.
 The idea is that this framework will be useful for all of the example
 games in this repo, so it needs to be largely game-agnostic.
+The AI module gives the game its search through
+new_search(state, reward_function, player, **options), which returns an
+object with get_best_move(state), start_pondering(state) and
+stop_pondering() (see ai/uct.py).
 """
 
 from importlib.machinery import SourceFileLoader
@@ -26,16 +31,21 @@ def load_module_from_path(path):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
+    args = sys.argv[1:]
+    ponder = "--ponder" in args
+    if ponder:
+        args.remove("--ponder")
+    if len(args) != 2:
         print("USAGE: python3 " + sys.argv[0] +\
-                " path/to/game path/to/ai" + os.linesep)
+                " path/to/game path/to/ai [--ponder]" + os.linesep)
         exit(1)
     else:
 
-        game_module = load_module_from_path(sys.argv[1])
-        ai_module = load_module_from_path(sys.argv[2])
+        game_module = load_module_from_path(args[0])
+        ai_module = load_module_from_path(args[1])
 
         ui.game_module = game_module
         ui.ai_module = ai_module
+        ui.ponder = ponder
         ui.start_game()
 